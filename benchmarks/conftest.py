@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def no_parse_cache(monkeypatch):
+    """Benchmarks measure parsing, so the on-disk parse cache and the shared frame store are disabled. Chats are not saved."""
+    from handlers.frame_store_handler import get_frame_store
+
+    monkeypatch.setenv('PARSE_CACHE_DIR', '')
+    monkeypatch.setenv('INGEST_WORKERS', '1')
+    monkeypatch.setenv('CHAT_HISTORY_DB', '')
+    # with no room, entries are dropped as soon as no session holds them
+    monkeypatch.setattr(get_frame_store(), 'max_bytes', 0)
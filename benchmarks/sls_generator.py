@@ -0,0 +1,103 @@
+"""
+Generator of synthetic SLS Marks .zip files, laid out like the exports teachers download from SLS:
+
+    row 1: assignment title
+    row 2: section titles, above the first question of each section
+    row 3: activity titles, above the first question of each activity
+    row 4: marks per question
+    row 5: column headers: 'Attempt Date', 'Form Class', 'Index Number', 'Name', 'Q1', 'Q2', ...
+    row 6+: one row per student; unattempted students have an empty 'Attempt Date' and empty scores
+"""
+import csv
+import io
+import math
+import random
+import zipfile
+from datetime import datetime, timedelta
+
+
+FIRST_NAMES = ['Tan', 'Lim', 'Lee', 'Ng', 'Wong', 'Goh', 'Chua', 'Ong', 'Koh', 'Teo', 'Muhammad', 'Nur', 'Siti', 'Priya', 'Arjun']
+LAST_NAMES = ['Wei Ling', 'Jun Jie', 'Xin Yi', 'Hui Min', 'Zhi Hao', 'Aisyah', 'Farhan', 'Kavya', 'Rohan', 'Jia Hui']
+
+
+class FakeUploadedFile:
+    """Stands in for Streamlit's UploadedFile in benchmarks: a name and getvalue()."""
+
+    def __init__(self, name, content):
+        self.name = name
+        self._content = content
+
+
+    def getvalue(self):
+        return self._content
+
+
+def make_marks_csv(title='Assignment', students=40, questions=20, sections=4, form_class='2E1',
+                   unattempted_rate=0.1, seed=0):
+    """Returns the bytes of one SLS marks CSV."""
+    rng = random.Random(seed)
+    marks = [rng.choice([1, 2, 3, 4, 5]) for _ in range(questions)]
+    questions_per_section = max(1, math.ceil(questions / max(1, sections)))
+
+    section_row = ['', '', '', '']
+    activity_row = ['', '', '', '']
+    for q in range(questions):
+        if q % questions_per_section == 0:
+            section_row.append(f'Section {q // questions_per_section + 1}')
+            activity_row.append(f'Activity {q // questions_per_section + 1}')
+        else:
+            section_row.append('')
+            activity_row.append('')
+
+    rows = [
+        [title] + [''] * (questions + 3),
+        section_row,
+        activity_row,
+        ['', '', '', ''] + [str(m) for m in marks],
+        ['Attempt Date', 'Form Class', 'Index Number', 'Name'] + [f'Q{q + 1}' for q in range(questions)],
+    ]
+
+    start = datetime(2024, 10, 1, 8, 0)
+    for index in range(1, students + 1):
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {index:02d}'
+        if rng.random() < unattempted_rate:
+            rows.append(['', form_class, str(index), name] + [''] * questions)
+        else:
+            attempt_date = start + timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+            scores = [str(rng.randint(0, m)) for m in marks]
+            rows.append([attempt_date.strftime('%Y-%m-%d %H:%M:%S'), form_class, str(index), name] + scores)
+
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def make_marks_zip(assignment=1, form_class='2E1', subject='Mathematics', date='20241031', **kwargs):
+    """Returns (file name, zip bytes) for one assignment, named the way SLS names Marks exports."""
+    title = f'{assignment}.1 Topic {assignment}'
+    csv_name = f'Marks_{form_class} {subject}_{title}.csv'
+    file_name = f'Marks_{form_class} {subject}_{title}_{date}.zip'
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        # a fixed timestamp keeps the zip bytes, and so their content hash, reproducible
+        info = zipfile.ZipInfo(csv_name, date_time=(2024, 10, 31, 0, 0, 0))
+        info.compress_type = zipfile.ZIP_DEFLATED
+        zf.writestr(info, make_marks_csv(title=title, form_class=form_class, seed=assignment, **kwargs))
+    return file_name, buffer.getvalue()
+
+
+def make_uploads(assignments=1, classes=1, students=40, questions=20, sections=4):
+    """Returns FakeUploadedFile objects for `assignments` assignments in each of `classes` form classes."""
+    uploads = []
+    for c in range(classes):
+        form_class = f'2E{c + 1}'
+        for a in range(1, assignments + 1):
+            name, content = make_marks_zip(a, form_class, students=students, questions=questions, sections=sections)
+            uploads.append(FakeUploadedFile(name, content))
+    return uploads
+
+
+def make_files_info(uploads):
+    """Converts uploads to the {'name', 'content'} dicts that process_zip_files takes."""
+    return [{'name': upload.name, 'content': upload.getvalue()} for upload in uploads]
@@ -0,0 +1,43 @@
+"""
+Behaviour tests of SLS Marks CSV parsing, on synthetic exports.
+
+Run with:
+    python -m pytest benchmarks/test_csv_parsing.py
+"""
+import io
+import pandas as pd
+
+from benchmarks.sls_generator import make_marks_csv
+from handlers.file_handler import process_csv_content, read_csv_record
+
+
+def test_read_csv_record_joins_a_quoted_line_break():
+    f = io.BytesIO(b'Title,"Section\n1",x\nnext,row\n')
+    assert read_csv_record(f) == ['Title', 'Section\n1', 'x']
+    assert read_csv_record(f) == ['next', 'row']
+
+
+def test_quoted_line_break_in_header_rows():
+    content = make_marks_csv(students=40)
+    # SLS quotes section and activity titles that the teacher typed over two lines
+    multiline = content.replace(b'Section 1', b'"Section\n1"').replace(b'Activity 2', b'"Activity\r\n2"')
+    assert multiline.count(b'\n') > content.count(b'\n')
+
+    expected = process_csv_content(io.BytesIO(content))
+    df = process_csv_content(io.BytesIO(multiline))
+    pd.testing.assert_frame_equal(df, expected)
+    assert len(df) == 40
+
+
+def test_quoted_line_break_in_a_student_row():
+    content = make_marks_csv(students=40)
+    header, _, rows = content.partition(b'Q20\n')
+    first_row, _, rest = rows.partition(b'\n')
+    fields = first_row.split(b',')
+    fields[3] = b'"' + fields[3].replace(b' ', b'\n', 1) + b'"'
+
+    df = process_csv_content(io.BytesIO(header + b'Q20\n' + b','.join(fields) + b'\n' + rest))
+    expected = process_csv_content(io.BytesIO(content))
+    assert len(df) == 40
+    assert df['Name'].iloc[0] == expected['Name'].iloc[0].replace(' ', '\n', 1)
+    pd.testing.assert_series_equal(df['Percentage'], expected['Percentage'])
@@ -0,0 +1,131 @@
+"""
+Behaviour tests of the shared frame store: entry ownership and release, and the datasets that
+sessions share after one of them evicted files to stay within its budget.
+
+Run with:
+    python -m pytest benchmarks/test_frame_store.py
+"""
+import gc
+import pandas as pd
+import pytest
+import streamlit as st
+
+from benchmarks.sls_generator import make_marks_zip, FakeUploadedFile
+from handlers import frame_store_handler
+from handlers.file_handler import ingest_zip_files, append_to_dataframe
+from handlers.frame_store_handler import SharedFrameStore, get_frame_store
+from handlers.session_store_handler import SessionStore
+from handlers.state_manager import AppState
+
+
+EARLIER_EXPORT = (1, '20241001')
+LATEST_EXPORT = (2, '20241031')
+STUDENTS = 400
+
+
+@pytest.fixture
+def frame_store(monkeypatch):
+    """A fresh, process-wide frame store with room for every entry."""
+    store = SharedFrameStore(512 * 1024 * 1024)
+    monkeypatch.setattr(frame_store_handler, '_frame_store', store)
+    return store
+
+
+def make_upload(export):
+    assignment, date = export
+    return FakeUploadedFile(*make_marks_zip(assignment=assignment, date=date, students=STUDENTS))
+
+
+def new_session():
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    return AppState()
+
+
+def upload_in_new_session(exports):
+    from main import handle_zip_uploads
+
+    app_state = new_session()
+    handle_zip_uploads(app_state, [make_upload(export) for export in exports])
+    return app_state, dict(st.session_state)
+
+
+def parse(export):
+    upload = make_upload(export)
+    frames, _ = ingest_zip_files([{'name': upload.name, 'content': upload.getvalue()}])
+    return append_to_dataframe(None, frames)
+
+
+def test_held_entries_are_kept_until_released():
+    store = SharedFrameStore(0)
+    df = pd.DataFrame({'a': range(10)})
+
+    store.put(('file', 'a'), df, owner='session')
+    assert store.get(('file', 'a')) is df
+
+    store.release(('file', 'a'), 'session')
+    assert store.get(('file', 'a')) is None
+
+
+def test_release_scheduled_while_the_lock_is_held():
+    store = SharedFrameStore(0)
+    store.put(('file', 'a'), pd.DataFrame({'a': range(10)}), owner='session')
+
+    # a garbage collection finalizer may run on a thread that is inside put()
+    with store._lock:
+        store.schedule_release_owner('session')
+
+    assert store.get_stats()['entries'] == 0
+
+
+def test_ended_session_releases_its_entries(frame_store):
+    frame_store.max_bytes = 0
+    session_store = SessionStore()
+    frame_store.put(('dataset', 'x'), pd.DataFrame({'a': range(10)}), owner=session_store.owner_id)
+    assert frame_store.get_stats()['held_entries'] == 1
+
+    del session_store
+    gc.collect()
+
+    assert frame_store.get_stats()['entries'] == 0
+
+
+def test_dataset_shared_after_an_eviction_is_the_parse_of_the_remaining_files(frame_store, monkeypatch):
+    monkeypatch.setenv('SESSION_MAX_MB', '0.07')
+    _, first_session = upload_in_new_session([EARLIER_EXPORT, LATEST_EXPORT])
+    assert len(first_session['session_store'].files) == 1
+    assert first_session['dataframe_fingerprint'] is not None
+
+    monkeypatch.setenv('SESSION_MAX_MB', '0')
+    st.session_state['first_session'] = first_session # keeps holding the shared dataframe
+    app_state, second_session = upload_in_new_session([LATEST_EXPORT])
+
+    assert second_session['dataframe_fingerprint'] == first_session['dataframe_fingerprint']
+    assert app_state.get_dataframe() is first_session['dataframe']
+    pd.testing.assert_frame_equal(app_state.get_dataframe(), parse(LATEST_EXPORT))
+
+
+def test_trimmed_dataframe_stays_private_when_the_files_cannot_be_rebuilt(monkeypatch):
+    # the conftest disables the parse cache and leaves no room in the frame store, so parsed files are gone
+    monkeypatch.setenv('SESSION_MAX_MB', '0.07')
+    _, first_session = upload_in_new_session([EARLIER_EXPORT, LATEST_EXPORT])
+    assert len(first_session['session_store'].files) == 1
+    assert first_session['dataframe_fingerprint'] is None
+
+    monkeypatch.setenv('SESSION_MAX_MB', '0')
+    app_state, _ = upload_in_new_session([LATEST_EXPORT])
+    assert app_state.get_dataframe() is not first_session['dataframe']
+    pd.testing.assert_frame_equal(app_state.get_dataframe(), parse(LATEST_EXPORT))
+
+
+@pytest.mark.parametrize('rebuildable', [True, False])
+def test_session_fits_its_budget_after_an_eviction(rebuildable, frame_store, monkeypatch):
+    if not rebuildable:
+        frame_store.max_bytes = 0
+    monkeypatch.setenv('SESSION_MAX_MB', '0.07')
+    app_state, _ = upload_in_new_session([EARLIER_EXPORT, LATEST_EXPORT])
+
+    usage = app_state.get_storage_usage()
+    assert usage['files'] == 1
+    assert usage['total_bytes'] <= usage['max_bytes']
+    assert 'memory limit' in app_state.get_chat_history()[-1]['content']
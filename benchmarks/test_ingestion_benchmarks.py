@@ -0,0 +1,82 @@
+"""
+Ingestion benchmarks on synthetic SLS Marks .zip files.
+
+Run with:
+    python -m pytest benchmarks --benchmark-only
+Compare against a saved baseline with --benchmark-save=<name> and --benchmark-compare.
+"""
+import io
+import pytest
+import streamlit as st
+
+from benchmarks.sls_generator import make_marks_csv, make_uploads, make_files_info
+from handlers.file_handler import is_valid_zip_file, process_csv_content, process_zip_files
+from handlers.state_manager import AppState
+
+
+# (assignments, students): from a single class up to a department's worth of exports
+SIZES = [(1, 40), (10, 40), (50, 40), (200, 40)]
+SIZE_IDS = [f'{assignments}x{students}' for assignments, students in SIZES]
+
+
+@pytest.mark.parametrize('students', [40, 400, 4000])
+def test_process_csv_content(benchmark, students):
+    content = make_marks_csv(students=students, questions=30)
+
+    def parse():
+        with io.BytesIO(content) as f:
+            return process_csv_content(f)
+
+    df = benchmark(parse)
+    assert len(df) == students
+
+
+def test_is_valid_zip_file(benchmark):
+    upload = make_uploads(assignments=1)[0]
+    assert benchmark(is_valid_zip_file, upload) is True
+
+
+@pytest.mark.parametrize('assignments,students', SIZES, ids=SIZE_IDS)
+def test_process_zip_files(benchmark, assignments, students):
+    files_info = make_files_info(make_uploads(assignments=assignments, students=students))
+    df = benchmark(process_zip_files, files_info)
+    assert len(df) == assignments * students
+
+
+@pytest.mark.parametrize('assignments,students', SIZES, ids=SIZE_IDS)
+def test_handle_zip_uploads(benchmark, assignments, students):
+    from main import handle_zip_uploads
+
+    uploads = make_uploads(assignments=assignments, students=students)
+
+    def fresh_session():
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        return (AppState(), uploads), {}
+
+    benchmark.pedantic(handle_zip_uploads, setup=fresh_session, rounds=5)
+    assert len(AppState().get_dataframe()) == assignments * students
+
+
+@pytest.mark.parametrize('assignments,students', SIZES, ids=SIZE_IDS)
+def test_handle_zip_uploads_shared(benchmark, assignments, students, monkeypatch):
+    """Another session uploading files that are already in the shared frame store."""
+    from main import handle_zip_uploads
+    from handlers.frame_store_handler import get_frame_store
+
+    monkeypatch.setattr(get_frame_store(), 'max_bytes', 512 * 1024 * 1024)
+    uploads = make_uploads(assignments=assignments, students=students)
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    handle_zip_uploads(AppState(), uploads)
+    first_session = dict(st.session_state)
+
+    def fresh_session():
+        for key in list(st.session_state.keys()):
+            if key != 'first_session':
+                del st.session_state[key]
+        return (AppState(), uploads), {}
+
+    st.session_state['first_session'] = first_session # keeps holding the shared dataframe
+    benchmark.pedantic(handle_zip_uploads, setup=fresh_session, rounds=5)
+    assert AppState().get_dataframe() is first_session['dataframe']
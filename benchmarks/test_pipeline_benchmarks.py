@@ -0,0 +1,94 @@
+"""
+Agent pipeline benchmarks that measure our own overhead (agent construction, prompt building,
+REPL execution, reruns) without network latency, by replaying recorded OpenAI responses.
+
+Record the cassette once against live OpenAI (needs the OPENAI key), then replay offline:
+    LLM_CASSETTE_MODE=record python -m pytest benchmarks/test_pipeline_benchmarks.py --benchmark-disable
+    LLM_CASSETTE_MODE=replay python -m pytest benchmarks/test_pipeline_benchmarks.py --benchmark-only
+LLM_CASSETTE_PATH (default cassettes/llm.json) and LLM_CASSETTE_LATENCY_MS are also honoured.
+"""
+import json
+import os
+import pytest
+import streamlit as st
+
+from benchmarks.sls_generator import make_uploads, make_files_info
+from handlers.answer_cache_handler import get_answer_cache
+from handlers.cassette_handler import Cassette, get_cassette_from_env
+from handlers.file_handler import process_zip_files
+from handlers.llm_handler import LLMClientRegistry, set_llm_registry
+from handlers.state_manager import AppState
+
+
+QUESTIONS = [
+    'What are the names of the assignments I have uploaded?',
+    'What is the average percentage of students who attempted each assignment?',
+]
+
+
+@pytest.fixture
+def dataframe():
+    return process_zip_files(make_files_info(make_uploads(assignments=5, students=40)))
+
+
+@pytest.fixture
+def offline_registry(tmp_path):
+    """A registry that replays an empty cassette: enough to build agents, and any LLM call fails fast."""
+    path = tmp_path / 'empty.json'
+    path.write_text(json.dumps({}))
+    set_llm_registry(LLMClientRegistry(cassette=Cassette(str(path), 'replay')))
+    yield
+    set_llm_registry(None)
+
+
+@pytest.fixture
+def cassette_registry():
+    if os.getenv('LLM_CASSETTE_MODE') not in ('record', 'replay'):
+        pytest.skip('set LLM_CASSETTE_MODE=record or replay to run the end-to-end pipeline benchmarks')
+    cassette = get_cassette_from_env()
+    set_llm_registry(LLMClientRegistry(cassette=cassette))
+    yield cassette
+    set_llm_registry(None)
+
+
+def test_create_agent_executor(benchmark, offline_registry, dataframe):
+    from handlers.agent_builder import create_agent_executor
+    from handlers.aggregate_handler import build_aggregate_cube
+
+    cube = build_aggregate_cube(dataframe)
+    agent = benchmark(create_agent_executor, dataframe, None, 1, cube)
+    assert agent is not None
+
+
+def test_rerun_agent_check(benchmark, offline_registry, dataframe):
+    """The per-rerun check that decides whether the agent must be rebuilt."""
+    from handlers.agent_builder import create_agent_executor
+
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    app_state = AppState()
+    app_state.set_dataframe(dataframe, 'fingerprint')
+    app_state.set_agent_executor(create_agent_executor(dataframe, None, app_state.get_dataframe_version()), app_state.get_dataframe_version())
+
+    result = benchmark(lambda: app_state.get_agent_dataframe_version() != app_state.get_dataframe_version())
+    assert result is False
+
+
+@pytest.mark.parametrize('question', QUESTIONS)
+def test_chat_query(benchmark, cassette_registry, dataframe, question):
+    from handlers.agent_builder import create_agent_executor
+    from main import handle_chat_input
+
+    def fresh_session():
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        get_answer_cache().clear()
+        app_state = AppState()
+        app_state.set_dataframe(dataframe, 'fingerprint')
+        app_state.set_agent_executor(create_agent_executor(dataframe, None, 1), 1)
+        return (app_state, question), {}
+
+    # record each interaction once; replays can be repeated
+    rounds = 1 if cassette_registry.mode == 'record' else 5
+    benchmark.pedantic(handle_chat_input, setup=fresh_session, rounds=rounds)
+    assert not AppState().get_chat_history()[-1]['content'].startswith('I apologize')
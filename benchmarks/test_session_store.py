@@ -0,0 +1,69 @@
+"""
+Behaviour tests of a session's file record and its eviction of the oldest file's rows.
+
+Run with:
+    python -m pytest benchmarks/test_session_store.py
+"""
+import pandas as pd
+
+from benchmarks.sls_generator import make_marks_zip
+from handlers.file_handler import ingest_zip_files, append_to_dataframe, get_content_hash
+from handlers.session_store_handler import SessionStore
+
+
+def ingest(*exports):
+    """Parses (assignment, date, kwargs) exports, and returns a SessionStore holding them with the consolidated dataframe and per-file frames."""
+    files_info = []
+    for assignment, date, kwargs in exports:
+        name, content = make_marks_zip(assignment=assignment, date=date, **kwargs)
+        files_info.append({'name': name, 'content': content, 'hash': get_content_hash(content)})
+    frames, errors = ingest_zip_files(files_info)
+    assert errors == [None] * len(files_info)
+
+    store = SessionStore(max_bytes=0)
+    for file_info, frame in zip(files_info, frames):
+        store.add_file(file_info['name'], file_info['hash'], frame)
+    return store, append_to_dataframe(None, frames), frames
+
+
+def sorted_rows(df):
+    return df.astype(str).sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_evicts_rows_of_an_assignment_re_exported_under_another_date():
+    # the later export has different attempts, so most of the earlier export's rows are only in that file
+    store, dataframe, frames = ingest(
+        (1, '20241001', {'unattempted_rate': 0.5}),
+        (1, '20241031', {'unattempted_rate': 0.0}),
+        (2, '20241031', {}),
+    )
+
+    name, trimmed = store.evict_oldest_file(dataframe)
+
+    assert name.endswith('_20241001.zip')
+    assert len(trimmed) < len(dataframe)
+    pd.testing.assert_frame_equal(sorted_rows(trimmed), sorted_rows(append_to_dataframe(None, frames[1:])))
+    assert len(store.get_file_hashes()) == 2
+
+
+def test_keeps_rows_that_a_remaining_file_also_has():
+    # the later export adds five students; the first 40 rows are the same in both files
+    store, dataframe, frames = ingest(
+        (1, '20241001', {'students': 40}),
+        (1, '20241031', {'students': 45}),
+    )
+    assert len(dataframe) == 45
+
+    name, trimmed = store.evict_oldest_file(dataframe)
+
+    assert name.endswith('_20241001.zip')
+    pd.testing.assert_frame_equal(sorted_rows(trimmed), sorted_rows(frames[1]))
+
+
+def test_keeps_the_latest_file():
+    store, dataframe, _ = ingest((1, '20241001', {}), (2, '20241031', {}))
+
+    store.evict_oldest_file(dataframe)
+
+    assert store.evict_oldest_file(dataframe) == (None, dataframe)
+    assert len(store.files) == 1
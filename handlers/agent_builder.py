@@ -4,32 +4,30 @@ sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 import streamlit as st
 import pandas as pd
-from langchain_openai import ChatOpenAI
 from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain_core.prompts import ChatPromptTemplate
 from handlers.tools.pandasai_tool import PandasAITool
 from handlers.tools.rag_tool import RAGTool
-import os
-from dotenv import load_dotenv
+from handlers.tools.aggregate_tool import AggregateTool
+from handlers.aggregate_handler import build_aggregate_cube
+from handlers.llm_handler import get_chat_model
+from handlers.tracing_handler import start_span
 
 
-def create_agent_executor(dataframe:pd.DataFrame, vectorstore):
+def create_agent_executor(dataframe:pd.DataFrame, vectorstore, dataframe_version=None, aggregate_cube=None, dataframe_fingerprint=None):
     """
     Creates and returns a LangChain AgentExecutor with PandasAI and RAG tools.
     """
+    rows = len(dataframe) if dataframe is not None else None
+    with start_span('create_agent_executor', {'dataframe.rows': rows, 'dataframe.version': dataframe_version}) as span:
+        agent_executor = build_agent_executor(dataframe, vectorstore, dataframe_version, aggregate_cube, dataframe_fingerprint)
+        span.set_attribute('agent.tools', len(agent_executor.tools) if agent_executor else 0)
+        return agent_executor
+
+
+def build_agent_executor(dataframe:pd.DataFrame, vectorstore, dataframe_version=None, aggregate_cube=None, dataframe_fingerprint=None):
     
-    if load_dotenv():
-        llm = ChatOpenAI(
-            model='gpt-4o-mini',
-            temperature=0,
-            api_key=os.getenv('OPENAI'),
-        )
-    else:
-        llm = ChatOpenAI(
-            model='gpt-4o-mini',
-            temperature=0,
-            api_key=st.secrets['OPENAI'],
-        )
+    llm = get_chat_model()
 
     if not llm:
         st.error("Cannot create agent: LLM not initialized.")
@@ -39,16 +37,18 @@ def create_agent_executor(dataframe:pd.DataFrame, vectorstore):
         st.warning("Cannot create agent: No dataframe provided.")
         return None
     
-    if vectorstore is None:
-        st.warning("Cannot create agent: No vectorstore provided.")
-
     tools = []
     
     try:
-        pandas_tool = PandasAITool(dataframe=dataframe)
+        pandas_tool = PandasAITool(dataframe=dataframe, dataframe_version=dataframe_version, dataframe_fingerprint=dataframe_fingerprint)
         tools.append(pandas_tool)
 
-        rag_tool = RAGTool(vectorstore=vectorstore)
+        if aggregate_cube is None:
+            aggregate_cube = build_aggregate_cube(dataframe)
+        aggregate_tool = AggregateTool(cube=aggregate_cube)
+        tools.append(aggregate_tool)
+
+        rag_tool = RAGTool(vectorstore=vectorstore) # None uses the shared vectorstore, loaded on first use
         tools.append(rag_tool)
         
     except Exception as e:
@@ -68,6 +68,7 @@ def create_agent_executor(dataframe:pd.DataFrame, vectorstore):
                     You have access to the following tools.
 
                     Instructions:
+                    0. Use the 'aggregate_lookup' tool first for the names of the uploaded assignments and form classes, student counts, attempt rates, average/min/max scores per assignment or form class, and the top or bottom students in an assignment. Only use 'data_analyser' when 'aggregate_lookup' cannot answer the question.
                     1. Use the 'data_analyser' tool to answer questions about the assignments and student performance in the assignments. Make sure you analyse and use all the rows in all the dataframes in your calculations. Do not use .head(), .sample(), or sample the data. If you only have five rows in your analysis, check and load the ORIGINAL dataframes again.
                     2. Use the 'knowledge_base' tool to retrieve information on the EdTech Masterplan 2030 and key applications of technology.
                     3. Combine information from both sources as needed to answer complex queries, especially when asked for interventions or what teachers can do to help improve student performance according to the EdTech Masterplan and Key Applications of Technology.
@@ -76,8 +77,10 @@ def create_agent_executor(dataframe:pd.DataFrame, vectorstore):
                     5. You should only use the tools provided and not come up with your own suggestions. 
                     6. Always provide a helpful and comprehensive answer. If you cannot find relevant information, state that you don't know.
                     7. Format your response in a way that is easy to read and understand. Use markdown for tables and lists where appropriate. Do not use code blocks or code snippets or data types such as dictionaries or json in your response.
+                    8. The conversation so far may include a summary of earlier turns and the results of earlier tool calls. Use them to resolve follow-up questions, e.g. 'that assignment' or 'the weakest class', and answer from the earlier tool results instead of calling the same tool again when they already contain the answer.
                     """
                 ),
+                ("placeholder", "{chat_history}"),
                 ("human", "{input}"),
                 ("placeholder", "{agent_scratchpad}"),
             ]
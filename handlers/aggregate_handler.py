@@ -0,0 +1,97 @@
+import pandas as pd
+
+
+CUBE_KEYS = ['Assignment', 'Form Class', 'Attempted']
+GROUP_BY_COLUMNS = {
+    'assignment': ['Assignment'],
+    'form_class': ['Form Class'],
+    'assignment_and_form_class': ['Assignment', 'Form Class'],
+}
+
+
+class AggregateCube:
+    """
+    Small precomputed summary of the consolidated marks dataframe, indexed by
+    assignment x form class x attempted status. Common questions (averages, attempt rates)
+    are answered from it by lookup. Top/bottom N students are ranked on request from the
+    dataframe itself, which the cube refers to rather than copies.
+    """
+
+    def __init__(self, dataframe: pd.DataFrame):
+        self.dataframe = dataframe
+        self.cube = (
+            dataframe.groupby(CUBE_KEYS, observed=True)
+            .agg(
+                students=('Percentage', 'size'),
+                percentage_sum=('Percentage', 'sum'),
+                percentage_min=('Percentage', 'min'),
+                percentage_max=('Percentage', 'max'),
+            )
+            .reset_index()
+            # Percentage is float32 in the dataframe, which would round to values such as 37.29999923706055
+            .astype({'percentage_sum': 'float64', 'percentage_min': 'float64', 'percentage_max': 'float64'})
+        )
+        self.assignments = sorted(self.cube['Assignment'].astype(str).unique())
+        self.form_classes = sorted(self.cube['Form Class'].astype(str).unique())
+
+
+    @staticmethod
+    def contains(column, pattern):
+        """Case-insensitive substring match, done once per category for categorical columns."""
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            categories = column.cat.categories
+            return column.isin(categories[categories.astype(str).str.contains(pattern, case=False, regex=False)])
+        return column.astype(str).str.contains(pattern, case=False, regex=False)
+
+
+    def filter(self, table, assignment=None, form_class=None):
+        """Filters by case-insensitive substring match on assignment and form class names."""
+        if assignment:
+            table = table[self.contains(table['Assignment'], assignment)]
+        if form_class:
+            table = table[self.contains(table['Form Class'], form_class)]
+        return table
+
+
+    def summary(self, group_by='assignment', assignment=None, form_class=None, include_unattempted=False):
+        """Returns student counts, attempt rate and average/min/max percentage per group."""
+        columns = GROUP_BY_COLUMNS[group_by]
+        cube = self.filter(self.cube, assignment, form_class)
+        if cube.empty:
+            return None
+
+        attempted = cube[cube['Attempted']]
+        totals = cube.groupby(columns, observed=True)['students'].sum()
+        scored = cube if include_unattempted else attempted
+        grouped = scored.groupby(columns, observed=True)
+
+        result = pd.DataFrame({
+            'Students': totals,
+            'Attempted': attempted.groupby(columns, observed=True)['students'].sum(),
+        }).fillna(0).astype(int)
+        result['Attempt Rate (%)'] = (result['Attempted'] / result['Students'] * 100).round(1)
+        result['Average (%)'] = (grouped['percentage_sum'].sum() / grouped['students'].sum() * 100).round(1)
+        result['Min (%)'] = (grouped['percentage_min'].min() * 100).round(1)
+        result['Max (%)'] = (grouped['percentage_max'].max() * 100).round(1)
+        return result.reset_index()
+
+
+    def rank(self, n=5, bottom=False, assignment=None, form_class=None, include_unattempted=False):
+        """Returns the top (or bottom) n students of each matching assignment by percentage."""
+        ranking = self.filter(self.dataframe, assignment, form_class)
+        if not include_unattempted:
+            ranking = ranking[ranking['Attempted']]
+        if ranking.empty:
+            return None
+
+        ranking = ranking[['Assignment', 'Form Class', 'Index Number', 'Name', 'Percentage', 'Attempted']]
+        ranking = ranking.sort_values(['Assignment', 'Percentage'], ascending=[True, bottom], kind='stable')
+        result = ranking.groupby('Assignment', observed=True, sort=False).head(n).copy()
+        result['Percentage (%)'] = (result['Percentage'].astype('float64') * 100).round(1)
+        return result.drop(columns=['Percentage']).reset_index(drop=True)
+
+
+def build_aggregate_cube(dataframe: pd.DataFrame):
+    if dataframe is None or dataframe.empty:
+        return None
+    return AggregateCube(dataframe)
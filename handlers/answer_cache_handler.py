@@ -0,0 +1,52 @@
+from cachetools import TTLCache
+import re
+import threading
+from handlers.config_handler import get_int_env
+
+
+def normalize_query(query: str):
+    """Lower-cases the query, collapses whitespace and drops trailing punctuation, so trivially different phrasings share a key."""
+    query = re.sub(r'\s+', ' ', query.strip().lower())
+    return query.rstrip(' ?.!')
+
+
+class AnswerCache:
+    """
+    Process-wide cache of answers shared by all sessions, keyed by a namespace (the final agent
+    answer or a tool name), the fingerprint of the data the answer was computed from, and the
+    normalized query. Entries are evicted least recently used once full, and expire after a TTL.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+
+    def get(self, namespace, fingerprint, query):
+        if fingerprint is None:
+            return None
+        with self._lock:
+            return self._cache.get((namespace, fingerprint, normalize_query(query)))
+
+
+    def set(self, namespace, fingerprint, query, answer):
+        if fingerprint is None:
+            return
+        with self._lock:
+            self._cache[(namespace, fingerprint, normalize_query(query))] = answer
+
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+
+_answer_cache = AnswerCache(
+    maxsize=get_int_env('ANSWER_CACHE_MAX_ENTRIES', 1024),
+    ttl=get_int_env('ANSWER_CACHE_TTL_SECONDS', 3600),
+)
+
+
+def get_answer_cache() -> AnswerCache:
+    return _answer_cache
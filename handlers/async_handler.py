@@ -0,0 +1,43 @@
+import asyncio
+import threading
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Returns a single event loop that runs forever in a background thread. All async LLM work goes
+    through it, so the pooled async HTTP client is always used from the loop it was created on.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-llm-loop', daemon=True).start()
+        return _loop
+
+
+def run_coroutine(coroutine):
+    """Runs a coroutine on the background event loop and blocks until it returns."""
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+def iterate_async(async_iterable):
+    """Consumes an async iterable on the background event loop from synchronous code, e.g. a Streamlit script."""
+    iterator = async_iterable.__aiter__()
+
+    async def next_item():
+        return await iterator.__anext__()
+
+    try:
+        while True:
+            try:
+                yield run_coroutine(next_item())
+            except StopAsyncIteration:
+                return
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            run_coroutine(aclose())
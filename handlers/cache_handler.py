@@ -0,0 +1,93 @@
+import pyarrow as pa
+import os
+import logging
+import uuid
+from handlers.config_handler import get_int_env
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when the parsed output changes shape, so that stale cache files are never read back.
+CACHE_VERSION = 1
+
+
+def get_cache_dir():
+    """Directory of the content-addressed cache of parsed uploads. An empty PARSE_CACHE_DIR disables the cache."""
+    return os.getenv('PARSE_CACHE_DIR', os.path.join('.cache', 'parsed_uploads'))
+
+
+def get_cache_max_bytes():
+    return get_int_env('PARSE_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+
+
+def get_cache_path(file_hash):
+    return os.path.join(get_cache_dir(), f'{file_hash}.v{CACHE_VERSION}.arrow')
+
+
+def load_cached_table(file_hash):
+    """
+    Returns the parsed rows cached for the SHA-256 `file_hash` of a zip file as a memory-mapped
+    pyarrow.Table, or None on a cache miss.
+    """
+    if not get_cache_dir() or not file_hash:
+        return None
+
+    path = get_cache_path(file_hash)
+    try:
+        with pa.memory_map(path, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        os.utime(path) # mark as recently used for LRU eviction
+        return table
+    except (FileNotFoundError, pa.ArrowInvalid, OSError):
+        return None
+
+
+def save_cached_table(file_hash, table: pa.Table):
+    """Writes the parsed rows of a zip file to the cache, then evicts least recently used entries over the size limit."""
+    cache_dir = get_cache_dir()
+    if not cache_dir or not file_hash:
+        return
+
+    path = get_cache_path(file_hash)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path) # atomic, so concurrent readers never see a partial file
+    except OSError as e:
+        logger.warning("Could not write parse cache entry %s: %s", file_hash, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+
+    evict_cache(get_cache_max_bytes())
+
+
+def evict_cache(max_bytes):
+    """Deletes the least recently used cache files until the cache fits within `max_bytes`."""
+    cache_dir = get_cache_dir()
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith('.arrow'):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
@@ -0,0 +1,158 @@
+"""
+Record/replay of OpenAI HTTP traffic, so the agent pipeline can run offline and deterministically.
+
+In 'record' mode, every chat and embedding request goes to OpenAI as usual, and the response is
+saved in a JSON cassette keyed by a hash of the request. In 'replay' mode, responses are served
+from the cassette with an optional artificial latency, and no network or API key is needed.
+The cassette sits below LangChain at the httpx transport level, and is selected through the same
+LLMClientRegistry that builds every chat and embedding model:
+
+    LLM_CASSETTE_MODE=record|replay
+    LLM_CASSETTE_PATH=cassettes/llm.json
+    LLM_CASSETTE_LATENCY_MS=0
+"""
+import asyncio
+import base64
+import hashlib
+import httpx
+import json
+import os
+import threading
+import time
+from handlers.config_handler import get_float_env
+
+
+class Cassette:
+
+    def __init__(self, path, mode='replay', latency_ms=0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown cassette mode '{mode}'. Use 'record' or 'replay'.")
+        self.path = path
+        self.mode = mode
+        self.latency = latency_ms / 1000
+        self._lock = threading.Lock()
+        self._interactions = {} # request key -> list of recorded responses
+        self._replay_counts = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self._interactions = json.load(f)
+        elif mode == 'replay':
+            raise FileNotFoundError(f"Cassette '{path}' does not exist. Record it first with LLM_CASSETTE_MODE=record.")
+
+
+    @staticmethod
+    def request_key(request: httpx.Request):
+        """Hashes the method, path and JSON body of a request, ignoring headers such as the API key."""
+        body = request.content
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True).encode('utf-8')
+        except ValueError:
+            pass
+        digest = hashlib.sha256(request.method.encode('utf-8') + b' ' + request.url.path.encode('utf-8') + b'\n' + body)
+        return digest.hexdigest()
+
+
+    def record(self, request: httpx.Request, response: httpx.Response, content: bytes):
+        interaction = {
+            'status_code': response.status_code,
+            'headers': {k: v for k, v in response.headers.items() if k.lower() in ('content-type', 'openai-model')},
+            'body': base64.b64encode(content).decode('ascii'),
+        }
+        with self._lock:
+            self._interactions.setdefault(self.request_key(request), []).append(interaction)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self._interactions, f, indent=1)
+
+
+    @staticmethod
+    def replay_headers(response: httpx.Response):
+        """Headers for a re-built response whose body has already been read and decoded."""
+        return {k: v for k, v in response.headers.items() if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+
+
+    def replay(self, request: httpx.Request):
+        """
+        Returns the recorded responses for identical requests in order, repeating the last one.
+        Unrecorded requests get a 404, which the OpenAI client raises as NotFoundError without retrying.
+        """
+        key = self.request_key(request)
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                message = f'No recorded response for {request.method} {request.url.path} in cassette {self.path}.'
+                return httpx.Response(404, json={'error': {'message': message, 'type': 'cassette_miss'}}, request=request)
+            count = self._replay_counts.get(key, 0)
+            self._replay_counts[key] = count + 1
+            interaction = interactions[min(count, len(interactions) - 1)]
+
+        return httpx.Response(
+            interaction['status_code'],
+            headers=interaction['headers'],
+            content=base64.b64decode(interaction['body']),
+            request=request,
+        )
+
+
+class CassetteTransport(httpx.BaseTransport):
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+        self._transport = httpx.HTTPTransport() if cassette.mode == 'record' else None
+
+
+    def handle_request(self, request):
+        if self.cassette.mode == 'replay':
+            if self.cassette.latency:
+                time.sleep(self.cassette.latency)
+            return self.cassette.replay(request)
+
+        request.read()
+        response = self._transport.handle_request(request)
+        content = response.read()
+        response.close()
+        self.cassette.record(request, response, content)
+        return httpx.Response(response.status_code, headers=self.cassette.replay_headers(response), content=content, request=request)
+
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+        self._transport = httpx.AsyncHTTPTransport() if cassette.mode == 'record' else None
+
+
+    async def handle_async_request(self, request):
+        if self.cassette.mode == 'replay':
+            if self.cassette.latency:
+                await asyncio.sleep(self.cassette.latency)
+            return self.cassette.replay(request)
+
+        await request.aread()
+        response = await self._transport.handle_async_request(request)
+        content = await response.aread()
+        await response.aclose()
+        self.cassette.record(request, response, content)
+        return httpx.Response(response.status_code, headers=self.cassette.replay_headers(response), content=content, request=request)
+
+
+    async def aclose(self):
+        if self._transport is not None:
+            await self._transport.aclose()
+
+
+def get_cassette_from_env():
+    """Returns the Cassette configured by LLM_CASSETTE_MODE, or None when running against live OpenAI."""
+    mode = os.getenv('LLM_CASSETTE_MODE', '')
+    if not mode:
+        return None
+    return Cassette(
+        os.getenv('LLM_CASSETTE_PATH', os.path.join('cassettes', 'llm.json')),
+        mode,
+        get_float_env('LLM_CASSETTE_LATENCY_MS', 0),
+    )
@@ -0,0 +1,147 @@
+"""
+SQLite store of chat histories, so that a session keeps only its most recent messages in memory.
+
+By default a chat is private to its session, and its messages are deleted when the session ends.
+Chats left behind by a shutdown or crash are deleted when the store is next opened.
+With CHAT_HISTORY_RESUME_FROM_URL=1, the chat id is kept in the page URL so that a page reload resumes
+the conversation. Anyone with the URL can then read and add to the chat, so only enable it where
+app links are not shared.
+
+    CHAT_HISTORY_DB=.cache/chat_history.sqlite3    # empty keeps histories in session memory only
+    CHAT_HISTORY_WINDOW=20                          # messages kept in session memory, and loaded per page of earlier messages
+    CHAT_HISTORY_RETENTION_DAYS=30                  # only with URL resume; private chats do not outlive the server
+    CHAT_HISTORY_RESUME_FROM_URL=0
+"""
+from collections import deque
+import os
+import logging
+import threading
+import time
+from handlers.config_handler import get_int_env, get_float_env
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_chat_window_size():
+    return max(1, get_int_env('CHAT_HISTORY_WINDOW', 20))
+
+
+def get_chat_db_path():
+    return os.getenv('CHAT_HISTORY_DB', os.path.join('.cache', 'chat_history.sqlite3'))
+
+
+def get_retention_days():
+    return get_float_env('CHAT_HISTORY_RETENTION_DAYS', 30)
+
+
+def is_url_resume_enabled():
+    return os.getenv('CHAT_HISTORY_RESUME_FROM_URL') == '1'
+
+
+class ChatHistoryStore:
+    """One SQLite connection shared by all sessions, serialised by a lock."""
+
+    def __init__(self, path):
+        from pysqlite3 import dbapi2 as sqlite3 # imported on first use, as at startup it is only needed for the chat history
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending_clears = deque() # chats of ended sessions, deleted on the next read or write
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                cached INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._connection.execute('CREATE INDEX IF NOT EXISTS messages_chat_id ON messages (chat_id, id)')
+        if is_url_resume_enabled():
+            self._connection.execute('DELETE FROM messages WHERE created_at < ?', (time.time() - get_retention_days() * 86400,))
+        else:
+            # private chats cannot be reached from a new session, so those left by a shutdown, crash or idle server go now
+            self._connection.execute('DELETE FROM messages')
+
+
+    @staticmethod
+    def to_message(row):
+        return {'id': row[0], 'role': row[1], 'content': row[2], 'cached': bool(row[3])}
+
+
+    def append(self, chat_id, role, content, cached=False):
+        """Saves a message and returns its id."""
+        with self._lock:
+            self._clear_pending()
+            cursor = self._connection.execute(
+                'INSERT INTO messages (chat_id, role, content, cached, created_at) VALUES (?, ?, ?, ?, ?)',
+                (chat_id, role, content, int(cached), time.time()),
+            )
+            return cursor.lastrowid
+
+
+    def get_messages(self, chat_id, limit, before_id=None):
+        """Returns up to `limit` messages of a chat, oldest first, ending with the latest message or the one before `before_id`."""
+        with self._lock:
+            self._clear_pending()
+            rows = self._connection.execute(
+                'SELECT id, role, content, cached FROM messages WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+                (chat_id, before_id if before_id is not None else 2**63 - 1, limit),
+            ).fetchall()
+        return [self.to_message(row) for row in reversed(rows)]
+
+
+    def count_before(self, chat_id, before_id):
+        with self._lock:
+            self._clear_pending()
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM messages WHERE chat_id = ? AND id < ?', (chat_id, before_id)
+            ).fetchone()[0]
+
+
+    def clear(self, chat_id):
+        with self._lock:
+            self._clear_pending()
+            self._connection.execute('DELETE FROM messages WHERE chat_id = ?', (chat_id,))
+
+
+    def schedule_clear(self, chat_id):
+        """
+        Deletes a chat on the next read or write. Safe to call from a garbage collection finalizer,
+        which may run while this thread holds the lock.
+        """
+        self._pending_clears.append(chat_id)
+
+
+    def _clear_pending(self):
+        while self._pending_clears:
+            self._connection.execute('DELETE FROM messages WHERE chat_id = ?', (self._pending_clears.popleft(),))
+
+
+_chat_store = None
+_chat_store_failed_path = None
+_chat_store_lock = threading.Lock()
+
+
+def get_chat_store():
+    """Returns the process-wide chat history store, or None if CHAT_HISTORY_DB is empty or the database cannot be opened."""
+    global _chat_store, _chat_store_failed_path
+    path = get_chat_db_path()
+    if not path:
+        return None
+    with _chat_store_lock:
+        if _chat_store is None:
+            if path == _chat_store_failed_path: # not retried on every message and rerun
+                return None
+            try:
+                _chat_store = ChatHistoryStore(path)
+            except Exception as e:
+                _chat_store_failed_path = path
+                logger.warning("Chat history store unavailable, keeping histories in memory: %s", e)
+                return None
+        return _chat_store
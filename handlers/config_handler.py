@@ -0,0 +1,17 @@
+import os
+
+
+def get_int_env(name, default):
+    """Returns an environment variable as an int, or the default if it is unset or not a number."""
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def get_float_env(name, default):
+    """Returns an environment variable as a float, or the default if it is unset or not a number."""
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
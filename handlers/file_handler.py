@@ -1,10 +1,35 @@
 import streamlit as st
+from handlers.cache_handler import load_cached_table, save_cached_table
+from handlers.config_handler import get_int_env
+from handlers.frame_store_handler import get_frame_store
+from handlers.tracing_handler import start_span, setup_tracing
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+from pyarrow import csv as pacsv
+from pandas.api.types import union_categoricals
 import zipfile
 import io
-import os
+import logging
 import csv
 from datetime import datetime
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+logger = logging.getLogger(__name__)
+
+
+CONSOLIDATED_COLUMNS = ['Attempt Date', 'Form Class', 'Index Number', 'Name', 'Percentage', 'Assignment', 'Attempted']
+CATEGORICAL_COLUMNS = ['Form Class', 'Name', 'Assignment']
+
+
+MAX_ZIP_MEMBERS = 100
+DEFAULT_MAX_CSV_MB = 50 # uncompressed size of the marks CSV; SLS exports are well under 1 MB
+DEFAULT_MAX_COMPRESSION_RATIO = 100 # CSV text compresses about 5-20x, zip bombs by 1000x or more
 
 
 def is_valid_zip_file(uploaded_file):
@@ -12,89 +37,383 @@ def is_valid_zip_file(uploaded_file):
     Checks if the uploaded file is a valid ZIP file according to specific rules:
     1. Filename has 4 parts delimited by '_'.
     2. Last part of filename is a valid YYYYMMDD date.
-    3. ZIP contains exactly one CSV file.
+    3. ZIP contains exactly one CSV file, within the size and compression ratio limits.
+
+    The upload's bytes are read in place, without copying them.
     """
     if uploaded_file is None:
-        return False, "No file uploaded."
+        return False
 
     file_name = uploaded_file.name
 
-    name_parts = file_name.replace('.zip', '').split('_')
-    date_string = name_parts[-1]
+    with start_span('is_valid_zip_file', {'file.name': file_name, 'file.bytes': getattr(uploaded_file, 'size', None)}) as span:
+        if not is_valid_zip_name(file_name):
+            span.set_attribute('zip.valid', False)
+            return False
+
+        try:
+            with open_zip_archive(get_upload_bytes(uploaded_file)) as zf:
+                _, error = check_zip_archive(zf, file_name)
+        except Exception as e:
+            error = f"Error: {e}"
+        span.set_attribute('zip.valid', error is None)
+        return error is None
+
+
+def is_valid_zip_name(file_name):
+    """Checks that the last '_' delimited part of the file name is a valid YYYYMMDD date."""
+    date_string = file_name.replace('.zip', '').split('_')[-1]
     try:
         datetime.strptime(date_string, '%Y%m%d')
+        return True
     except ValueError:
         return False
 
-    try:
-        zip_buffer = io.BytesIO(uploaded_file.getvalue())
-        with zipfile.ZipFile(zip_buffer, 'r') as zf:
-            csv_files = [name for name in zf.namelist() if name.endswith('.csv')]
 
-            if len(csv_files) == 0:
-                return False
-            elif len(csv_files) > 1:
-                return False
+def get_upload_bytes(uploaded_file):
+    """
+    Returns an uploaded file's bytes without copying them. Streamlit's UploadedFile is a BytesIO over
+    the uploaded bytes, and getvalue() returns that shared object (getbuffer() would copy it).
+    """
+    return uploaded_file.getvalue()
 
-            return True
 
-    except Exception as e:
-        return False, f"Error: {e}"
+def open_zip_archive(file_content):
+    # BytesIO shares a bytes object's buffer until it is written to, so the upload is not copied
+    return zipfile.ZipFile(io.BytesIO(file_content), 'r')
 
-def process_zip_files(uploaded_files_info):
-        
-    dataframe = pd.DataFrame(columns=['Attempt Date', 'Form Class', 'Index Number', 'Name', 'Percentage', 'Assignment'])
-    
-    for file_info in uploaded_files_info:
-        file_name = file_info['name']
-        file_content = file_info['content']
+
+
+def check_zip_archive(zf, file_name):
+    """
+    Checks the archive's directory before anything is decompressed. Returns (the CSV member's ZipInfo, None),
+    or (None, error message) if the archive does not hold exactly one CSV, or a member is larger than
+    ZIP_MAX_CSV_MB uncompressed or compressed more than ZIP_MAX_COMPRESSION_RATIO times, as zip bombs are.
+    Reads are capped at the declared sizes by zipfile, so members cannot expand beyond them.
+    """
+    members = zf.infolist()
+    if len(members) > MAX_ZIP_MEMBERS:
+        return None, f"'{file_name}' contains {len(members)} files. Marks .zip files contain a single CSV file."
+
+    csv_members = [member for member in members if member.filename.endswith('.csv')]
+    if len(csv_members) != 1:
+        return None, f"'{file_name}' contains {len(csv_members)} CSV files. Marks .zip files contain exactly one CSV file."
+
+    max_bytes = get_int_env('ZIP_MAX_CSV_MB', DEFAULT_MAX_CSV_MB) * 1024 * 1024
+    max_ratio = get_int_env('ZIP_MAX_COMPRESSION_RATIO', DEFAULT_MAX_COMPRESSION_RATIO)
+    for member in members:
+        if member.file_size > max_bytes:
+            return None, f"'{member.filename}' in '{file_name}' is {member.file_size / 1024 / 1024:.0f} MB uncompressed, over the {max_bytes // 1024 // 1024} MB limit."
+        if member.file_size > 1024 * 1024 and member.file_size > max_ratio * max(member.compress_size, 1):
+            return None, f"'{member.filename}' in '{file_name}' expands {member.file_size // max(member.compress_size, 1)} times when decompressed, and was rejected."
+
+    return csv_members[0], None
+
+
+def get_content_hash(file_content):
+    """Returns the SHA-256 hex digest of the uploaded file's bytes, used to recognise re-uploads."""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def get_dataset_fingerprint(file_hashes):
+    """Returns a fingerprint of a set of uploaded files, independent of the order they were uploaded in."""
+    return hashlib.sha256('\n'.join(sorted(file_hashes)).encode('utf-8')).hexdigest()
+
+
+def process_zip_files(uploaded_files_info, max_workers=None):
+    """
+    Processes a list of uploaded ZIP file information and returns a single consolidated dataframe.
+    """
+    with start_span('process_zip_files', {'files.count': len(uploaded_files_info)}) as span:
+        dataframe = append_to_dataframe(None, parse_zip_files(uploaded_files_info, max_workers))
+        span.set_attribute('dataframe.rows', len(dataframe))
+        return dataframe
+
+
+def parse_zip_files(uploaded_files_info, max_workers=None):
+    """
+    Parses each uploaded ZIP file separately. Returns a list aligned with `uploaded_files_info`
+    holding one dataframe per file, or None for files that could not be processed.
+    Errors are reported per file with st.error.
+    """
+    frames, errors = ingest_zip_files(uploaded_files_info, max_workers)
+    for error in errors:
+        if error:
+            st.error(error)
+    return frames
+
+
+def ingest_zip_files(uploaded_files_info, max_workers=None):
+    """
+    Validates and parses each uploaded ZIP file in a single pass. Returns two lists aligned with
+    `uploaded_files_info`: one dataframe or None per file, and one error message or None per file.
+
+    Files whose content hash is already in the on-disk parse cache are not parsed again.
+    When more than one worker is configured (argument or INGEST_WORKERS environment variable),
+    the files are decoded in a process pool, falling back to running serially if the pool cannot be used.
+    """
+    if max_workers is None:
+        max_workers = get_ingest_workers()
+
+    with start_span('ingest_zip_files', {'files.count': len(uploaded_files_info), 'ingest.workers': max_workers}) as span:
+        # files parsed before are shared from memory if another session still has them,
+        # and otherwise read back from the on-disk cache
+        file_hashes = [file_info.get('hash') or get_content_hash(file_info['content']) for file_info in uploaded_files_info]
+        shared_frames = [get_frame_store().get(('file', file_hash)) for file_hash in file_hashes]
+        tables = [load_cached_table(file_hash) if frame is None else None for file_hash, frame in zip(file_hashes, shared_frames)]
+        missing = [i for i, (table, frame) in enumerate(zip(tables, shared_frames)) if table is None and frame is None]
+        missing_names = [uploaded_files_info[i]['name'] for i in missing]
+        missing_contents = [uploaded_files_info[i]['content'] for i in missing]
+        span.set_attributes({
+            'frame_store.hits': sum(frame is not None for frame in shared_frames),
+            'parse_cache.hits': sum(table is not None for table in tables),
+            'files.parsed_bytes': sum(len(content) for content in missing_contents),
+        })
+
+        results = None
+        if max_workers > 1 and len(missing) > 1:
+            try:
+                pool = get_process_pool(max_workers)
+                results = list(pool.map(parse_zip_file, missing_names, missing_contents))
+            except (BrokenProcessPool, OSError) as e:
+                shutdown_process_pool()
+                logger.warning("Parallel ingestion unavailable, falling back to serial: %s", e)
+
+        if results is None:
+            results = [parse_zip_file(name, content) for name, content in zip(missing_names, missing_contents)]
+
+        errors = [None] * len(tables)
+        for i, (table, error) in zip(missing, results):
+            if error:
+                errors[i] = error
+            else:
+                save_cached_table(file_hashes[i], table)
+                tables[i] = table
+
+        frames = [
+            frame if frame is not None else get_frame_store().put(('file', file_hash), table.to_pandas()) if table is not None else None
+            for file_hash, frame, table in zip(file_hashes, shared_frames, tables)
+        ]
+        span.set_attribute('files.parsed_rows', sum(len(df) for df in frames if df is not None))
+        return frames, errors
+
+
+def load_parsed_frames(file_hashes):
+    """
+    Returns the parsed dataframes of files that were ingested before, from the shared frame store or
+    the on-disk parse cache, without their .zip bytes. Returns None if any file is in neither.
+    """
+    frames = []
+    for file_hash in file_hashes:
+        frame = get_frame_store().get(('file', file_hash))
+        if frame is None:
+            table = load_cached_table(file_hash)
+            if table is None:
+                return None
+            frame = get_frame_store().put(('file', file_hash), table.to_pandas())
+        frames.append(frame)
+    return frames
+
+
+def process_zip_file(file_name, file_content):
+    """
+    Extracts the single CSV from one uploaded ZIP file and returns its dataframe with the
+    'Assignment' column added, or None if the file could not be processed.
+    """
+    table, error = parse_zip_file(file_name, file_content)
+    if error:
+        st.error(error)
+        return None
+    return table.to_pandas()
+
+
+def parse_zip_file(file_name, file_content):
+    """
+    Validates and parses one uploaded ZIP file in a single pass: the archive is opened once over
+    the upload's bytes, its directory is checked, and the CSV member is stream-decoded.
+    Runs in the parent process or in a pool worker, so it must not call Streamlit.
+    Returns a (pyarrow.Table, None) tuple on success, or (None, error message) on failure.
+    """
+    with start_span('parse_zip_file', {'file.name': file_name, 'file.bytes': len(file_content)}) as span:
         try:
-            with zipfile.ZipFile(io.BytesIO(file_content), 'r') as zf:
-                csv_files = [name for name in zf.namelist() if name.endswith('.csv')]
-                if not csv_files:
-                    st.error(f"Internal error: No CSV found in '{file_name}'.")
-                    continue
-
-                with zf.open(csv_files[0]) as csv_file:
-                    csv_content = csv_file.read().decode('utf-8')
-                    with io.StringIO(csv_content) as f:
-                        df = process_csv_content(f)
-                        df['Assignment'] = csv_file.name.replace('.csv', '')
-                        dataframe = pd.concat([dataframe, df])
+            with open_zip_archive(file_content) as zf:
+                csv_member, error = check_zip_archive(zf, file_name)
+                if error:
+                    span.set_attribute('parse.error', error)
+                    return None, error
+
+                with zf.open(csv_member) as csv_file:
+                    df = process_csv_content(csv_file) # stream-decode straight from the zip member
+                    df['Assignment'] = csv_member.filename.replace('.csv', '')
+                    table = pa.Table.from_pandas(normalize_schema(df), preserve_index=False)
+                    span.set_attributes({'table.rows': table.num_rows, 'table.bytes': table.nbytes})
+                    return table, None
 
         except Exception as e:
-            st.error(f"Error processing ZIP file '{file_name}': {e}")
-    
-    dataframe = dataframe.drop_duplicates()
-    return dataframe
+            span.set_attribute('parse.error', str(e))
+            return None, f"Error processing ZIP file '{file_name}': {e}"
+
+
+def get_ingest_workers():
+    """Number of worker processes for parsing uploads. 1 (the default) parses serially."""
+    return max(1, get_int_env('INGEST_WORKERS', 1))
+
+
+_process_pool = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(max_workers):
+    """Returns a process pool shared by all sessions, re-created when the worker count changes."""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != max_workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False)
+            # spawn rather than fork, as the Streamlit server process runs many threads
+            # workers set up the same span exporter, so their parse spans are exported too
+            _process_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=setup_tracing)
+            _process_pool_workers = max_workers
+        return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+        _process_pool_workers = 0
+
+
+def normalize_schema(df):
+    """
+    Converts a parsed marks dataframe from object strings to compact, typed columns:
+    - 'Form Class', 'Name' and 'Assignment' as categoricals
+    - 'Index Number' as a small nullable integer
+    - 'Percentage' as float32
+    - 'Attempt Date' parsed to datetime (NaT when not attempted), plus a boolean 'Attempted' column
+    """
+    df = df.copy()
+
+    attempt_dates = df['Attempt Date'].astype(str).str.strip()
+    df['Attempted'] = attempt_dates != ''
+    df['Attempt Date'] = pd.to_datetime(attempt_dates.where(df['Attempted']), errors='coerce', format='mixed', dayfirst=True)
+
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype(str).astype('category')
+
+    # an integer dtype is only used if every index number given is an integer, e.g. not '12A', which would be lost
+    given = df['Index Number'].notna() & (df['Index Number'].astype(str).str.strip() != '')
+    index_numbers = pd.to_numeric(df['Index Number'].where(given), errors='coerce')
+    if index_numbers[given].notna().all() and index_numbers.dropna().mod(1).eq(0).all() and not (index_numbers.abs() >= 2**31).any():
+        df['Index Number'] = index_numbers.astype('Int16' if index_numbers.abs().max() < 2**15 or index_numbers.isna().all() else 'Int32')
+    else:
+        df['Index Number'] = df['Index Number'].astype(str).astype('category')
+
+    df['Percentage'] = pd.to_numeric(df['Percentage'], errors='coerce').astype('float32')
+
+    return df[CONSOLIDATED_COLUMNS]
+
+
+def concat_frames(frames):
+    """
+    Concatenates normalized dataframes without losing the categorical dtypes. pd.concat falls back
+    to object columns when the categories differ, so each frame is first given the union of categories.
+    """
+    for column in CATEGORICAL_COLUMNS:
+        if all(isinstance(df[column].dtype, pd.CategoricalDtype) for df in frames):
+            categories = union_categoricals([df[column] for df in frames]).categories
+            frames = [df.assign(**{column: df[column].cat.set_categories(categories)}) for df in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def append_to_dataframe(dataframe, new_frames):
+    """
+    Appends newly parsed per-file dataframes to the consolidated dataframe in a single concat.
+    Duplicate rows are dropped among the new rows, and only re-checked against the existing
+    rows when an assignment that is already loaded appears again.
+    """
+    new_frames = [df for df in new_frames if df is not None]
+    if not new_frames:
+        if dataframe is None:
+            return normalize_schema(pd.DataFrame(columns=CONSOLIDATED_COLUMNS[:-1]))
+        return dataframe
+
+    new_df = concat_frames(new_frames).drop_duplicates()
+    if dataframe is None or dataframe.empty:
+        return new_df.reset_index(drop=True)
+
+    combined = concat_frames([dataframe, new_df])
+    if new_df['Assignment'].isin(dataframe['Assignment']).any():
+        combined = combined.drop_duplicates().reset_index(drop=True)
+    return combined
+
+
+HEADER_ROWS = 5 # title, sections, activities, marks per question, column headers
+METADATA_COLUMNS = 4 # 'Attempt Date', 'Form Class', 'Index Number', 'Name'
+
+
+def read_csv_record(f):
+    """
+    Reads one CSV record from a binary file object and returns its fields. A quoted field may span
+    lines, so lines are read until the record's quotes are balanced.
+    """
+    record = f.readline()
+    while record.count(b'"') % 2 and record.endswith(b'\n'):
+        record += f.readline()
+    return next(csv.reader(io.StringIO(record.decode('utf-8'), newline=''), delimiter=',', quotechar='"'), [])
 
 
 def process_csv_content(f):
     """
     Reads the csv content of the file and reorganises it according to the following columns:
     'Attempt Date', 'Form Class', 'Index Number', 'Name', 'Percentage'
+
+    `f` is a binary file object, e.g. the handle returned by `zf.open()`. The header rows are
+    read record by record once, and the data block is then loaded in a single pyarrow read.
+    Quoted values may contain line breaks, e.g. in section or activity titles.
     """
 
-    reader = csv.reader(f, delimiter=',', quotechar='"', lineterminator='\n')
-    
-    marks_per_question = []
-    for i, row in enumerate(reader):
-        if i < 3: # skip the first three rows
-            continue
-        elif i == 3: # fourth row contains marks per question
-            marks_per_question = row
-        elif i == 4: # fifth row contains column headers
-            data_df = pd.DataFrame(columns=row)
-        else: # subsequent rows contain data
-            data_df.loc[i-5] = row
-        
-    data_df.iloc[:, 4:] = data_df.iloc[:, 4:].apply(pd.to_numeric, errors='coerce') # force numeric conversion for question columns
-    data_df['Total Score'] = data_df.iloc[:,4:].sum(axis=1)
-    total_marks = sum_list(marks_per_question[4:])
-    data_df['Percentage'] = data_df['Total Score'] / total_marks
-    data_df = data_df.drop(data_df.iloc[:, 4:-1].columns, axis=1) # drop all question columns and Total Score column; keep only metadata columns and Percentage column
-
-    return data_df
+    with start_span('process_csv_content') as span:
+        if not hasattr(f, 'peek'):
+            f = io.BufferedReader(f) # e.g. a BytesIO, which cannot peek at the data block
+        header_rows = [read_csv_record(f) for _ in range(HEADER_ROWS)]
+
+        marks_per_question = header_rows[3] # fourth row contains marks per question
+        column_headers = header_rows[4] # fifth row contains column headers
+
+        # read every column as a string so that values such as '2E1' or '001' are not inferred as numbers
+        column_names = [f'column_{i}' for i in range(len(column_headers))]
+        if f.peek(1):
+            table = pacsv.read_csv(
+                f,
+                read_options=pacsv.ReadOptions(column_names=column_names),
+                parse_options=pacsv.ParseOptions(newlines_in_values=True),
+                convert_options=pacsv.ConvertOptions(
+                    column_types={name: pa.string() for name in column_names},
+                    strings_can_be_null=False,
+                ),
+            )
+            data_df = table.to_pandas()
+        else:
+            data_df = pd.DataFrame(columns=column_names, dtype=object)
+
+        # force numeric conversion for all question columns in one pass
+        question_df = data_df.iloc[:, METADATA_COLUMNS:]
+        scores = pd.to_numeric(question_df.to_numpy(dtype=object).ravel(), errors='coerce').reshape(question_df.shape)
+        total_score = np.nansum(scores, axis=1)
+        total_marks = sum_list(marks_per_question[METADATA_COLUMNS:])
+
+        # keep only metadata columns and Percentage column
+        data_df = data_df.iloc[:, :METADATA_COLUMNS]
+        data_df.columns = column_headers[:METADATA_COLUMNS]
+        data_df['Percentage'] = total_score / total_marks
+        span.set_attributes({'csv.rows': len(data_df), 'csv.question_columns': question_df.shape[1]})
+
+        return data_df
     
 
 def sum_list(marks:list):
@@ -0,0 +1,125 @@
+"""
+Process-wide store of parsed data shared by all sessions, keyed by content:
+- ('file', content hash of a .zip file) -> the file's parsed dataframe
+- ('dataset', fingerprint of a set of files) -> (consolidated dataframe, aggregate cube)
+
+Teachers often upload the same SLS exports, so a file parsed by one session is not parsed again by
+another, and sessions with the same set of files hold references to one consolidated dataframe.
+Entries are read-only: code that modifies a dataframe, such as the pandas agent's REPL, works on its
+own copy. Sessions acquire the entries they use, and release them when they move to other data or
+end. Entries no session holds stay cached, and are evicted least recently used once the store
+exceeds SHARED_FRAME_STORE_MAX_MB.
+"""
+from collections import OrderedDict, deque
+import pandas as pd
+import threading
+from handlers.aggregate_handler import AggregateCube
+from handlers.config_handler import get_float_env
+
+
+def get_store_max_bytes():
+    return int(get_float_env('SHARED_FRAME_STORE_MAX_MB', 512) * 1024 * 1024)
+
+
+def get_value_bytes(value):
+    """Memory used by a dataframe, or by a (dataframe, aggregate cube) dataset."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, tuple):
+        return sum(get_value_bytes(item) for item in value)
+    if isinstance(value, AggregateCube):
+        return get_value_bytes(value.cube)
+    return 0
+
+
+class SharedFrameStore:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> {'value', 'bytes', 'owners'}, least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._pending_releases = deque() # owners of ended sessions, released on the next put, release or get_stats
+
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry['value']
+
+
+    def put(self, key, value, owner=None):
+        """
+        Adds a value unless the key is already stored, and returns the stored value, so that all
+        callers share one copy. With an owner, the entry is also acquired for it.
+        """
+        with self._lock:
+            self._release_pending()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {'value': value, 'bytes': get_value_bytes(value), 'owners': set()}
+                self._entries[key] = entry
+                self._total_bytes += entry['bytes']
+            self._entries.move_to_end(key)
+            if owner is not None:
+                entry['owners'].add(owner)
+            self._evict()
+            return entry['value']
+
+
+    def release(self, key, owner):
+        with self._lock:
+            self._release_pending()
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['owners'].discard(owner)
+            self._evict()
+
+
+    def schedule_release_owner(self, owner):
+        """
+        Releases every entry held by an owner, e.g. a session that has ended, on the next put, release
+        or get_stats. Safe to call from a garbage collection finalizer, which may run while this thread
+        holds the lock.
+        """
+        self._pending_releases.append(owner)
+
+
+    def _release_pending(self):
+        while self._pending_releases:
+            owner = self._pending_releases.popleft()
+            for entry in self._entries.values():
+                entry['owners'].discard(owner)
+
+
+    def _evict(self):
+        # entries held by a session are in use, and would stay in memory even if dropped from the store
+        for key in list(self._entries.keys()):
+            if self._total_bytes <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if not entry['owners']:
+                del self._entries[key]
+                self._total_bytes -= entry['bytes']
+
+
+    def get_stats(self):
+        with self._lock:
+            self._release_pending()
+            self._evict()
+            return {
+                'entries': len(self._entries),
+                'held_entries': sum(1 for entry in self._entries.values() if entry['owners']),
+                'total_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_frame_store = SharedFrameStore(get_store_max_bytes())
+
+
+def get_frame_store() -> SharedFrameStore:
+    return _frame_store
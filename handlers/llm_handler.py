@@ -0,0 +1,247 @@
+import streamlit as st
+import httpx
+import os
+import threading
+import json
+import re
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from handlers.cassette_handler import CassetteTransport, AsyncCassetteTransport, get_cassette_from_env
+from handlers.tracing_handler import is_tracing_enabled, start_manual_span, end_span
+
+
+CHAT_MODEL = 'gpt-4o-mini'
+EMBEDDING_MODEL = 'text-embedding-3-small'
+
+
+def resolve_api_key():
+    """Reads the OpenAI API key from .env if present, otherwise from Streamlit secrets."""
+    if load_dotenv():
+        return os.getenv('OPENAI')
+    else:
+        return st.secrets['OPENAI']
+
+
+USAGE_PATTERN = re.compile(rb'"(prompt_tokens|completion_tokens|total_tokens)":\s*(\d+)')
+
+
+def get_request_attributes(request: httpx.Request):
+    """Span attributes of an OpenAI request: endpoint, model, request size and whether it is streamed."""
+    attributes = {'http.method': request.method, 'url.path': request.url.path, 'llm.request_bytes': len(request.content)}
+    try:
+        body = json.loads(request.content)
+        attributes['llm.model'] = body.get('model')
+        attributes['llm.stream'] = bool(body.get('stream', False))
+        if isinstance(body.get('input'), list):
+            attributes['llm.embedding_inputs'] = len(body['input'])
+    except ValueError:
+        pass
+    return attributes
+
+
+def get_response_attributes(status_code, size, tail):
+    """
+    Span attributes of an OpenAI response. Token usage is read from the end of the body, where it is
+    found both in JSON responses and in the last event of a stream (sent because of stream_usage=True).
+    """
+    attributes = {'http.status_code': status_code, 'llm.response_bytes': size}
+    for key, value in USAGE_PATTERN.findall(tail):
+        attributes[f'llm.{key.decode()}'] = int(value)
+    return attributes
+
+
+class TracedByteStream(httpx.SyncByteStream):
+    """Passes a response body through, ending the request's span once the body has been read and closed."""
+
+    def __init__(self, stream, span, status_code):
+        self._stream = stream
+        self._span = span
+        self._status_code = status_code
+        self._size = 0
+        self._tail = b''
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._size += len(chunk)
+            self._tail = (self._tail + chunk)[-4096:]
+            yield chunk
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            end_span(self._span, get_response_attributes(self._status_code, self._size, self._tail))
+
+
+class AsyncTracedByteStream(httpx.AsyncByteStream):
+
+    def __init__(self, stream, span, status_code):
+        self._stream = stream
+        self._span = span
+        self._status_code = status_code
+        self._size = 0
+        self._tail = b''
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._size += len(chunk)
+            self._tail = (self._tail + chunk)[-4096:]
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            end_span(self._span, get_response_attributes(self._status_code, self._size, self._tail))
+
+
+class TracingTransport(httpx.BaseTransport):
+    """Records a span for every chat and embedding request, covering the whole response including streamed tokens."""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request):
+        request.read()
+        span = start_manual_span(f'openai {request.url.path}', get_request_attributes(request))
+        try:
+            response = self._transport.handle_request(request)
+        except Exception as e:
+            end_span(span, {'error.type': type(e).__name__})
+            raise
+        if response.is_stream_consumed:
+            # responses built from bytes, e.g. replayed from a cassette, are read on creation
+            end_span(span, get_response_attributes(response.status_code, len(response.content), response.content[-4096:]))
+        else:
+            response.stream = TracedByteStream(response.stream, span, response.status_code)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncTracingTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        span = start_manual_span(f'openai {request.url.path}', get_request_attributes(request))
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as e:
+            end_span(span, {'error.type': type(e).__name__})
+            raise
+        if response.is_stream_consumed:
+            # responses built from bytes, e.g. replayed from a cassette, are read on creation
+            end_span(span, get_response_attributes(response.status_code, len(response.content), response.content[-4096:]))
+        else:
+            response.stream = AsyncTracedByteStream(response.stream, span, response.status_code)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class LLMClientRegistry:
+    """
+    Process-wide registry of chat and embedding models. Each configuration is built once and
+    reuses a single pooled HTTP client, so connections and TLS sessions are kept alive across
+    reruns, sessions and tool calls.
+    """
+
+    def __init__(self, api_key=None, cassette=None):
+        self._api_key = api_key
+        self._cassette = cassette # record/replay all requests instead of only calling OpenAI
+        self._lock = threading.Lock()
+        self._chat_models = {}
+        self._embeddings_models = {}
+        self._http_client = None
+        self._http_async_client = None
+
+
+    def get_api_key(self):
+        with self._lock:
+            if self._api_key is None and self._cassette is not None and self._cassette.mode == 'replay':
+                self._api_key = 'replay' # replayed requests never reach OpenAI
+            if self._api_key is None:
+                self._api_key = resolve_api_key()
+            return self._api_key
+
+
+    def get_http_clients(self):
+        with self._lock:
+            if self._http_client is None:
+                limits = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+                if self._cassette is not None:
+                    transport, async_transport = CassetteTransport(self._cassette), AsyncCassetteTransport(self._cassette)
+                else:
+                    transport, async_transport = httpx.HTTPTransport(limits=limits), httpx.AsyncHTTPTransport(limits=limits)
+                if is_tracing_enabled():
+                    transport, async_transport = TracingTransport(transport), AsyncTracingTransport(async_transport)
+                self._http_client = httpx.Client(limits=limits, timeout=httpx.Timeout(120.0), transport=transport)
+                self._http_async_client = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120.0), transport=async_transport)
+            return self._http_client, self._http_async_client
+
+
+    def get_chat_model(self, model=CHAT_MODEL, temperature=0):
+        key = (model, temperature)
+        if key not in self._chat_models:
+            api_key = self.get_api_key()
+            http_client, http_async_client = self.get_http_clients()
+            with self._lock:
+                if key not in self._chat_models:
+                    self._chat_models[key] = ChatOpenAI(
+                        model=model,
+                        temperature=temperature,
+                        api_key=api_key,
+                        http_client=http_client,
+                        http_async_client=http_async_client,
+                        stream_usage=True, # streamed answers also report their token usage
+                    )
+        return self._chat_models[key]
+
+
+    def get_embeddings_model(self, model=EMBEDDING_MODEL):
+        if model not in self._embeddings_models:
+            api_key = self.get_api_key()
+            http_client, http_async_client = self.get_http_clients()
+            with self._lock:
+                if model not in self._embeddings_models:
+                    self._embeddings_models[model] = OpenAIEmbeddings(
+                        model=model,
+                        api_key=api_key,
+                        http_client=http_client,
+                        http_async_client=http_async_client,
+                        # with a cassette, send raw text so requests do not depend on downloading tiktoken files
+                        check_embedding_ctx_length=self._cassette is None,
+                    )
+        return self._embeddings_models[model]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_llm_registry() -> LLMClientRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = LLMClientRegistry(cassette=get_cassette_from_env())
+        return _registry
+
+
+def set_llm_registry(registry):
+    """Replaces the process-wide registry, e.g. with a local stub in tests. Pass None to reset."""
+    global _registry
+    with _registry_lock:
+        _registry = registry
+
+
+def get_chat_model(model=CHAT_MODEL, temperature=0):
+    return get_llm_registry().get_chat_model(model, temperature)
+
+
+def get_embeddings_model(model=EMBEDDING_MODEL):
+    return get_llm_registry().get_embeddings_model(model)
@@ -0,0 +1,190 @@
+"""
+Bounded conversation memory of the agent executor, so that follow-up questions can refer to earlier
+turns without the teacher restating assignment names, within a fixed token budget:
+
+- the most recent turns, verbatim
+- a running summary of older turns, compacted by the chat model as turns leave the recent window
+- facts from recent tool results, e.g. the resolved assignment names, so that the agent does not
+  call a tool again for something it has already looked up
+
+    CONVERSATION_MEMORY_MAX_TOKENS=1200    # summary, facts and recent turns added to each prompt
+    CONVERSATION_MEMORY_MAX_FACTS=6        # most recent tool results kept as facts
+"""
+from collections import OrderedDict
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+import threading
+import logging
+from handlers.token_handler import count_tokens, truncate_to_tokens
+from handlers.config_handler import get_int_env
+
+
+logger = logging.getLogger(__name__)
+
+
+FACT_TOOLS = ('aggregate_lookup', 'data_analyser', 'knowledge_base')
+DATA_TOOLS = ('aggregate_lookup', 'data_analyser') # tools whose results depend on the uploaded files
+
+SUMMARY_PROMPT = """Update the summary of a conversation between a teacher and an assistant that analyses the teacher's \
+student assignment data. Keep the assignment names, form classes, students, numbers and decisions that later questions \
+may refer to. Reply with the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}"""
+
+
+
+def get_memory_max_tokens():
+    return get_int_env('CONVERSATION_MEMORY_MAX_TOKENS', 1200)
+
+
+def get_memory_max_facts():
+    return get_int_env('CONVERSATION_MEMORY_MAX_FACTS', 6)
+
+
+def format_turn(turn):
+    return f"Teacher: {turn['user']}\nAssistant: {turn['assistant']}"
+
+
+class ConversationMemory:
+    """
+    Memory of one chat session. A quarter of the budget is for the summary, a quarter for the facts
+    and the rest for the recent turns, so a prompt's memory never exceeds the budget however long
+    the conversation runs.
+    """
+
+    def __init__(self, max_tokens=None, max_facts=None):
+        self.max_tokens = get_memory_max_tokens() if max_tokens is None else max_tokens
+        self.max_facts = get_memory_max_facts() if max_facts is None else max_facts
+        self.summary_budget = self.max_tokens // 4
+        self.facts_budget = self.max_tokens // 4
+        self.turns_budget = self.max_tokens - self.summary_budget - self.facts_budget
+        self.turns = [] # {'user', 'assistant', 'tokens'}, oldest first
+        self.summary = ''
+        self.facts = OrderedDict() # key -> {'tool', 'text', 'tokens'}, oldest first
+
+
+    def is_empty(self):
+        return not self.turns and not self.summary
+
+
+    def add_turn(self, user_query, answer, summarize=True, config=None):
+        """
+        Adds a question and its answer. Once the recent turns exceed their budget, the oldest are
+        compacted into the summary until they fill half of it, so that the summary is updated every few
+        turns rather than on every turn. Turns are summarised by the chat model if `summarize` is True,
+        or else by keeping their latest lines.
+        """
+        user_query = truncate_to_tokens(user_query, self.turns_budget // 4)
+        answer = truncate_to_tokens(answer, self.turns_budget // 2)
+        self.turns.append({'user': user_query, 'assistant': answer, 'tokens': count_tokens(format_turn({'user': user_query, 'assistant': answer}))})
+
+        if sum(turn['tokens'] for turn in self.turns) <= self.turns_budget:
+            return
+        overflow = []
+        while len(self.turns) > 1 and sum(turn['tokens'] for turn in self.turns) > self.turns_budget // 2:
+            overflow.append(self.turns.pop(0))
+        self.compact(overflow, summarize, config)
+
+
+    def compact(self, turns, summarize=True, config=None):
+        turns_text = '\n\n'.join(format_turn(turn) for turn in turns)
+        if summarize:
+            try:
+                from handlers.llm_handler import get_chat_model
+                prompt = SUMMARY_PROMPT.format(max_words=self.summary_budget * 3 // 4, summary=self.summary or '(none)', turns=turns_text)
+                response = get_chat_model().invoke(prompt, config=config)
+                self.summary = truncate_to_tokens(str(response.content).strip(), self.summary_budget)
+                return
+            except Exception as e:
+                logger.warning("Could not summarise the conversation, keeping its latest lines: %s", e)
+
+        lines = [line for line in (self.summary + '\n' + turns_text).splitlines() if line.strip()]
+        while len(lines) > 1 and count_tokens('\n'.join(lines)) > self.summary_budget:
+            lines.pop(0)
+        self.summary = truncate_to_tokens('\n'.join(lines), self.summary_budget)
+
+
+    def add_facts(self, facts):
+        """
+        Adds (key, tool, text) facts from tool results, replacing older results of the same tool call.
+        The oldest facts are dropped once there are more than max_facts or they exceed their budget.
+        """
+        for key, tool, text in facts:
+            text = truncate_to_tokens(text, max(1, self.facts_budget - count_tokens(key)))
+            self.facts.pop(key, None)
+            self.facts[key] = {'tool': tool, 'text': text, 'tokens': count_tokens(key) + count_tokens(text)}
+
+        while len(self.facts) > self.max_facts or (len(self.facts) > 1 and sum(fact['tokens'] for fact in self.facts.values()) > self.facts_budget):
+            self.facts.popitem(last=False)
+
+
+    def clear_data_facts(self):
+        """Forgets the facts about the uploaded data, e.g. when files are added or evicted."""
+        for key in [key for key, fact in self.facts.items() if fact['tool'] in DATA_TOOLS]:
+            del self.facts[key]
+
+
+    def get_messages(self):
+        """Returns the memory as chat messages for the prompt's chat_history placeholder."""
+        messages = []
+        context = []
+        if self.summary:
+            context.append(f"Summary of the earlier conversation:\n{self.summary}")
+        if self.facts:
+            facts = '\n\n'.join(f"{key}\n{fact['text']}" for key, fact in self.facts.items())
+            context.append(f"Results of earlier tool calls on the current data:\n{facts}")
+        if context:
+            messages.append(SystemMessage(content='\n\n'.join(context)))
+        for turn in self.turns:
+            messages.append(HumanMessage(content=turn['user']))
+            messages.append(AIMessage(content=turn['assistant']))
+        return messages
+
+
+    def count_tokens(self):
+        return sum(count_tokens(str(message.content)) for message in self.get_messages())
+
+
+class ToolFactRecorder(BaseCallbackHandler):
+    """Collects the results of the agent's tool calls in one query, to be kept as facts in the conversation memory."""
+
+    def __init__(self):
+        self.facts = []
+        self._pending = {}
+        self._lock = threading.Lock()
+
+
+    def on_tool_start(self, serialized, input_str, *, run_id, inputs=None, **kwargs):
+        tool = (serialized or {}).get('name') or kwargs.get('name')
+        if tool not in FACT_TOOLS: # e.g. the REPL of the nested pandas agent
+            return
+        if isinstance(inputs, dict):
+            arguments = ', '.join(f'{name}={value}' for name, value in inputs.items() if value is not None)
+        else:
+            arguments = input_str
+        with self._lock:
+            self._pending[run_id] = (f'{tool}({arguments})', tool)
+
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        with self._lock:
+            pending = self._pending.pop(run_id, None)
+        text = str(getattr(output, 'content', output))
+        if pending is None or not text or text.startswith('Error:'):
+            return
+        with self._lock:
+            self.facts.append((pending[0], pending[1], text))
+
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._pending.pop(run_id, None)
+
+
+    def get_facts(self):
+        with self._lock:
+            return list(self.facts)
@@ -4,37 +4,57 @@ sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 import streamlit as st
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_experimental.text_splitter import SemanticChunker
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import WebBaseLoader, PyPDFLoader, TextLoader
 import chromadb
 import os
-from dotenv import load_dotenv
+import logging
+import threading
+from handlers.llm_handler import get_llm_registry
 
 from langchain.prompts import PromptTemplate
 from langchain.retrievers.multi_query import MultiQueryRetriever
 from langchain.chains import RetrievalQA
 
-import tiktoken
+from handlers.token_handler import count_tokens # re-exported; the encoding is loaded once per process
 
-def count_tokens(text):
-    encoding = tiktoken.encoding_for_model('gpt-4o-mini')
-    return len(encoding.encode(text))
+
+logger = logging.getLogger(__name__)
 
 
 def get_embeddings_model():
-    if load_dotenv():
-        API_KEY=os.getenv('OPENAI')
-    else:
-        API_KEY=st.secrets['OPENAI']
-    
-    return OpenAIEmbeddings(model='text-embedding-3-small', api_key=API_KEY)
+    return get_llm_registry().get_embeddings_model()
 
 
-def create_vectorstore():
+EMBEDDING_CACHE_DIR = '../embedding_cache'
+EMBEDDING_BATCH_SIZE = 1000
+
+
+def get_cached_embeddings_model(cache_dir=EMBEDDING_CACHE_DIR):
+    """
+    Wraps the embeddings model with a persistent local cache keyed by (model name, SHA-256 of the text),
+    so rebuilding the vectorstore only embeds text that has not been embedded before.
+    Cache misses are sent to the API in batches of EMBEDDING_BATCH_SIZE.
+    """
+    # only the offline create_vectorstore() uses the cache, so agent builds do not import it
+    from langchain.embeddings import CacheBackedEmbeddings
+    from langchain.storage import LocalFileStore
 
     embeddings_model = get_embeddings_model()
+    return CacheBackedEmbeddings.from_bytes_store(
+        embeddings_model,
+        LocalFileStore(cache_dir),
+        namespace=embeddings_model.model,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        key_encoder='sha256',
+    )
+
+
+def create_vectorstore():
+
+    # the same cache serves the chunker's sentence embeddings and the chunk embeddings for indexing
+    embeddings_model = get_cached_embeddings_model()
 
     doc_list = [
         'EdTech Masterplan 2030 _ MOE.pdf',
@@ -50,7 +70,7 @@ def create_vectorstore():
             data = loader.load()
             loaded_docs.extend(data)
         except Exception as e:
-            print(f"Error loading {doc}: {e}")
+            logger.error("Error loading %s: %s", doc, e)
             continue
 
     # print("Total documents loaded:", len(loaded_docs))
@@ -62,15 +82,21 @@ def create_vectorstore():
 
     splitted_docs = text_splitter.split_documents(loaded_docs)
 
+    # rebuild the collection from scratch instead of appending duplicate chunks to it
+    client = chromadb.PersistentClient(path='../vector_db')
+    if 'semantic_embedding' in [collection.name for collection in client.list_collections()]:
+        client.delete_collection('semantic_embedding')
+
     vectorstore = Chroma.from_documents(
         documents=splitted_docs,
         embedding=embeddings_model,
         collection_name='semantic_embedding',
-        persist_directory='../vector_db'
+        client=client,
     )
 
 
 def load_vectorstore_from_directory():
+    """Opens a new client on the persisted vectorstore. Prefer get_shared_vectorstore(), which opens it once per process."""
     client = chromadb.PersistentClient(path="../vector_db")
     vectorstore = Chroma(
         client=client,
@@ -81,4 +107,39 @@ def load_vectorstore_from_directory():
     return vectorstore
 
 
+_vectorstore = None
+_vectorstore_lock = threading.Lock()
+_warmup_thread = None
+
+
+def get_shared_vectorstore():
+    """
+    Returns the vectorstore shared read-only by all sessions in this process. It is loaded on
+    first use, so sessions that never query the knowledge base do not pay for opening it.
+    """
+    global _vectorstore
+    if _vectorstore is None:
+        with _vectorstore_lock:
+            if _vectorstore is None:
+                _vectorstore = load_vectorstore_from_directory()
+    return _vectorstore
+
+
+def start_vectorstore_warmup():
+    """Loads the shared vectorstore in a background thread, once per process."""
+    global _warmup_thread
+    with _vectorstore_lock:
+        if _warmup_thread is not None or _vectorstore is not None:
+            return
+        _warmup_thread = threading.Thread(target=warm_up_vectorstore, name='vectorstore-warmup', daemon=True)
+    _warmup_thread.start()
+
+
+def warm_up_vectorstore():
+    try:
+        get_shared_vectorstore()
+    except Exception as e:
+        logger.warning("Vectorstore warm-up failed: %s", e)
+
+
 # create_vectorstore() # run this function as a python script, so that user does not need to wait for vectorstore to be created from scratch. comment out when completed.
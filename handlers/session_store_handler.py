@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+import uuid
+import weakref
+from handlers.frame_store_handler import get_frame_store
+from handlers.file_handler import CONSOLIDATED_COLUMNS
+from handlers.config_handler import get_float_env
+
+
+def get_session_max_bytes():
+    """Per-session memory budget for uploaded data, from SESSION_MAX_MB. 0 disables the budget."""
+    return int(get_float_env('SESSION_MAX_MB', 256) * 1024 * 1024)
+
+
+def get_frame_bytes(df):
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def get_row_hashes(df: pd.DataFrame):
+    """Hashes each row by its values. Equal rows hash alike across frames, whatever their category sets or integer widths."""
+    return pd.util.hash_pandas_object(df[CONSOLIDATED_COLUMNS], index=False).to_numpy()
+
+
+class SessionStore:
+    """
+    Compact record of the files ingested by one session. Raw .zip bytes are dropped once a file is
+    parsed, and per-file dataframes are not kept: each file is remembered by its content hash and the
+    hashes of its rows (8 bytes a row), which is enough to recognise re-uploads and to evict exactly
+    the rows only that file contributed when over the byte budget.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = get_session_max_bytes() if max_bytes is None else max_bytes
+        self.files = OrderedDict() # content hash -> {'name', 'row_hashes'}, oldest upload first
+        self.owner_id = uuid.uuid4().hex # identifies the session to the shared frame store
+        # release the session's shared data when Streamlit discards the session
+        weakref.finalize(self, get_frame_store().schedule_release_owner, self.owner_id)
+
+
+    def add_file(self, file_name, file_hash, df: pd.DataFrame):
+        self.files[file_hash] = {'name': file_name, 'row_hashes': np.unique(get_row_hashes(df))}
+
+
+    def has_file(self, file_hash):
+        return file_hash in self.files
+
+
+    def get_file_hashes(self):
+        return list(self.files.keys())
+
+
+    def get_usage(self, dataframe, aggregate_cube=None, chat_history=()):
+        """Returns the current memory use of the session's data in bytes, against its budget."""
+        aggregate_bytes = 0
+        if aggregate_cube is not None:
+            aggregate_bytes = get_frame_bytes(aggregate_cube.cube) # the cube refers to the dataframe rather than copying it
+        usage = {
+            'files': len(self.files),
+            'dataframe_bytes': get_frame_bytes(dataframe),
+            'aggregate_bytes': aggregate_bytes,
+            'chat_bytes': sum(len(message['content'].encode('utf-8')) for message in chat_history),
+            'file_index_bytes': sum(record['row_hashes'].nbytes for record in self.files.values()),
+            'max_bytes': self.max_bytes,
+        }
+        usage['total_bytes'] = usage['dataframe_bytes'] + usage['aggregate_bytes'] + usage['chat_bytes'] + usage['file_index_bytes']
+        return usage
+
+
+    def is_over_budget(self, usage):
+        return self.max_bytes > 0 and usage['total_bytes'] > self.max_bytes
+
+
+    def evict_oldest_file(self, dataframe: pd.DataFrame):
+        """
+        Forgets the least recently uploaded file, and returns its name with the dataframe without the
+        rows only it contributed. Rows that a remaining file also has, e.g. when the same assignment
+        was exported on two dates, are kept. Returns (None, dataframe) when at most one file is left.
+        """
+        if len(self.files) <= 1:
+            return None, dataframe
+
+        _, evicted = self.files.popitem(last=False)
+        remaining_hashes = np.concatenate([record['row_hashes'] for record in self.files.values()])
+        evicted_hashes = np.setdiff1d(evicted['row_hashes'], remaining_hashes)
+        if evicted_hashes.size and dataframe is not None:
+            dataframe = dataframe[~np.isin(get_row_hashes(dataframe), evicted_hashes)].reset_index(drop=True)
+            for column in ('Assignment', 'Form Class', 'Name'):
+                dataframe[column] = dataframe[column].cat.remove_unused_categories()
+        return evicted['name'], dataframe
@@ -1,72 +1,275 @@
 import streamlit as st
 import pandas as pd
-from langchain_community.vectorstores import Chroma
+import uuid
+import weakref
+from handlers.session_store_handler import SessionStore
+from handlers.file_handler import get_dataset_fingerprint, load_parsed_frames, append_to_dataframe
+from handlers.aggregate_handler import build_aggregate_cube
+from handlers.frame_store_handler import get_frame_store
+from handlers.chat_store_handler import get_chat_store, get_chat_window_size, is_url_resume_enabled
 
 class AppState:
 
     def __init__(self):
         
+        if "session_store" not in st.session_state:
+            st.session_state.session_store = SessionStore() # ingested files by content hash; raw .zip bytes are not kept
+        if "chat_id" not in st.session_state:
+            st.session_state.chat_id = self.get_new_chat_id()
         if "chat_history" not in st.session_state:
-            st.session_state.chat_history = []
-        if "uploaded_files_info" not in st.session_state:
-            st.session_state.uploaded_files_info = [] # List of {'name': 'file.zip', 'content': bytes}
+            store = get_chat_store()
+            # only the most recent messages are kept in memory; earlier ones stay in the chat store
+            st.session_state.chat_history = store.get_messages(st.session_state.chat_id, get_chat_window_size()) if store else []
+        if "earlier_messages" not in st.session_state:
+            st.session_state.earlier_messages = [] # earlier messages the user asked to see, oldest first
         if 'dataframe' not in st.session_state:
             st.session_state.dataframe = None # single dataframe with all student, percentage and assignments
-        if "vectorstore" not in st.session_state:
-            st.session_state.vectorstore = None
+        if 'aggregate_cube' not in st.session_state:
+            st.session_state.aggregate_cube = None # precomputed aggregates of the dataframe, built at ingest
+        if 'dataframe_version' not in st.session_state:
+            st.session_state.dataframe_version = 0 # incremented every time the dataframe changes
+        if 'dataframe_fingerprint' not in st.session_state:
+            st.session_state.dataframe_fingerprint = None # content fingerprint of the uploaded files, computed once at ingest
         if "agent_executor" not in st.session_state:
             st.session_state.agent_executor = None
+        if "agent_dataframe_version" not in st.session_state:
+            st.session_state.agent_dataframe_version = None # dataframe version the agent executor was built against
+        if "token_usage" not in st.session_state:
+            st.session_state.token_usage = {'queries': 0, 'llm_calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        if "query_token_usage" not in st.session_state:
+            st.session_state.query_token_usage = [] # usage of each answered query, most recent last
+        if "conversation_memory" not in st.session_state:
+            st.session_state.conversation_memory = None # created on the first query, as it needs LangChain
         if "initial_message_sent" not in st.session_state:
-            st.session_state.initial_message_sent = False
+            st.session_state.initial_message_sent = len(st.session_state.chat_history) > 0 # a resumed chat is not greeted again
 
 
-    def add_message(self, role, content):
-        st.session_state.chat_history.append({"role": role, "content": content})
+    @staticmethod
+    def get_new_chat_id():
+        if is_url_resume_enabled():
+            # opt-in: the chat id is kept in the page URL, so that a reload resumes the same conversation
+            chat_id = st.query_params.get('chat')
+            if not chat_id:
+                chat_id = uuid.uuid4().hex
+                st.query_params['chat'] = chat_id
+            return chat_id
+
+        # the chat is private to this session, and its saved messages are deleted once Streamlit discards the session
+        chat_id = uuid.uuid4().hex
+        store = get_chat_store()
+        if store is not None:
+            weakref.finalize(st.session_state.session_store, store.schedule_clear, chat_id)
+        return chat_id
+
+
+    def add_message(self, role, content, cached=False):
+        message = {"role": role, "content": content, "cached": cached}
+        store = get_chat_store()
+        if store is None:
+            st.session_state.chat_history.append(message)
+            return
+
+        message['id'] = store.append(st.session_state.chat_id, role, content, cached)
+        st.session_state.chat_history.append(message)
+        window_size = get_chat_window_size()
+        if len(st.session_state.chat_history) > window_size:
+            # older messages leave memory, and earlier messages that were shown are collapsed again
+            st.session_state.chat_history = st.session_state.chat_history[-window_size:]
+            st.session_state.earlier_messages = []
 
 
     def get_chat_history(self):
+        """Returns the recent window of the chat history."""
         return st.session_state.chat_history
 
 
+    def get_earlier_messages(self):
+        return st.session_state.earlier_messages
+
+
+    def get_first_loaded_message_id(self):
+        for message in st.session_state.earlier_messages + st.session_state.chat_history:
+            if 'id' in message:
+                return message['id']
+        return None
+
+
+    def has_earlier_messages(self):
+        store = get_chat_store()
+        first_id = self.get_first_loaded_message_id()
+        if store is None or first_id is None:
+            return False
+        return store.count_before(st.session_state.chat_id, first_id) > 0
+
+
+    def load_earlier_messages(self):
+        """Loads the page of messages before the earliest one loaded, for display."""
+        store = get_chat_store()
+        first_id = self.get_first_loaded_message_id()
+        if store is None or first_id is None:
+            return
+        page = store.get_messages(st.session_state.chat_id, get_chat_window_size(), before_id=first_id)
+        st.session_state.earlier_messages = page + st.session_state.earlier_messages
+
+
     def clear_chat_history(self):
+        store = get_chat_store()
+        if store is not None:
+            store.clear(st.session_state.chat_id)
         st.session_state.chat_history = []
+        st.session_state.earlier_messages = []
+        st.session_state.conversation_memory = None
+
+
+    def get_conversation_memory(self):
+        """Returns the agent's memory of this conversation, rebuilt from the recent window when a chat is resumed."""
+        if st.session_state.conversation_memory is None:
+            from handlers.memory_handler import ConversationMemory
+
+            memory = ConversationMemory()
+            history = st.session_state.chat_history
+            for question, answer in zip(history, history[1:]):
+                if question['role'] == 'user' and answer['role'] == 'assistant':
+                    memory.add_turn(question['content'], answer['content'], summarize=False)
+            st.session_state.conversation_memory = memory
+        return st.session_state.conversation_memory
+
+
+    def add_parsed_file(self, file_name, file_hash, df: pd.DataFrame):
+        st.session_state.session_store.add_file(file_name, file_hash, df)
+
+
+    def has_parsed_file(self, file_hash):
+        return st.session_state.session_store.has_file(file_hash)
+
 
+    def get_parsed_file_hashes(self):
+        return st.session_state.session_store.get_file_hashes()
 
-    def add_uploaded_file_info(self, file_name, file_content):
-        st.session_state.uploaded_files_info.append({
-            "name": file_name,
-            "content": file_content
-        })
 
+    def get_storage_usage(self):
+        return st.session_state.session_store.get_usage(self.get_dataframe(), self.get_aggregate_cube(), self.get_chat_history())
 
-    def get_uploaded_files_info(self):
-        return st.session_state.uploaded_files_info
 
+    def enforce_storage_budget(self, get_notice=None):
+        """
+        Evicts the data of the least recently uploaded files until the session fits its byte budget,
+        always keeping the latest file. get_notice(evicted_files) returns the message that tells the user
+        which files were evicted. It is added to the chat, and counted against the budget before it is.
+        Returns the names of the evicted files.
+        """
+        store = st.session_state.session_store
+        dataframe, aggregate_cube, fingerprint = self.get_dataframe(), self.get_aggregate_cube(), self.get_dataframe_fingerprint()
+        evicted_files = []
+        notice = []
+        while store.is_over_budget(store.get_usage(dataframe, aggregate_cube, self.get_chat_history() + notice)):
+            file_name, trimmed = store.evict_oldest_file(dataframe)
+            if file_name is None:
+                break
+            evicted_files.append(file_name)
+            # the frame that would be kept is measured, rather than the trimmed one it may be rebuilt as
+            dataframe, aggregate_cube, fingerprint = self.get_remaining_dataset(trimmed)
+            if get_notice is not None:
+                notice = [{'content': get_notice(evicted_files)}]
+
+        if evicted_files:
+            self.set_dataframe(dataframe, fingerprint, aggregate_cube)
+            if notice:
+                self.add_message('assistant', notice[0]['content'])
+        return evicted_files
+
+
+    def get_remaining_dataset(self, trimmed: pd.DataFrame):
+        """
+        Returns (dataframe, aggregate cube, fingerprint) for the files left after an eviction. A dataset
+        is only shared under the fingerprint of those files if it is built from exactly their parsed
+        frames. Otherwise the trimmed dataframe is kept private to this session, without a fingerprint.
+        """
+        file_hashes = st.session_state.session_store.get_file_hashes()
+        fingerprint = get_dataset_fingerprint(file_hashes)
+        dataset = get_frame_store().get(('dataset', fingerprint))
+        if dataset is not None:
+            return dataset[0], dataset[1], fingerprint
+        frames = load_parsed_frames(file_hashes)
+        if frames is None:
+            return trimmed, build_aggregate_cube(trimmed), None
+        dataframe = append_to_dataframe(None, frames)
+        return dataframe, build_aggregate_cube(dataframe), fingerprint
+
+
+    def set_dataframe(self, df: pd.DataFrame, fingerprint=None, aggregate_cube=None):
+        owner = st.session_state.session_store.owner_id
+        previous_fingerprint = st.session_state.dataframe_fingerprint
+        if fingerprint is not None:
+            # sessions with the same uploaded files share one copy of the dataframe and its aggregates
+            df, aggregate_cube = get_frame_store().put(('dataset', fingerprint), (df, aggregate_cube), owner)
+        if previous_fingerprint is not None and previous_fingerprint != fingerprint:
+            get_frame_store().release(('dataset', previous_fingerprint), owner)
+
+        if st.session_state.conversation_memory is not None:
+            st.session_state.conversation_memory.clear_data_facts() # earlier tool results may not hold for the new data
 
-    def set_dataframe(self, df: pd.DataFrame):
         st.session_state.dataframe = df
+        st.session_state.aggregate_cube = aggregate_cube
+        st.session_state.dataframe_version += 1
+        st.session_state.dataframe_fingerprint = fingerprint
+
+
+    def use_shared_dataset(self, fingerprint):
+        """Switches to the dataframe another session built from the same files. Returns False if none is stored."""
+        dataset = get_frame_store().get(('dataset', fingerprint))
+        if dataset is None:
+            return False
+        self.set_dataframe(dataset[0], fingerprint, dataset[1])
+        return True
 
 
     def get_dataframe(self):
         return st.session_state.dataframe
-    
 
-    def set_vectorstore(self, vectorstore: Chroma):
-        st.session_state.vectorstore = vectorstore
+
+    def get_aggregate_cube(self):
+        return st.session_state.aggregate_cube
 
 
-    def get_vectorstore(self):
-        return st.session_state.vectorstore
+    def get_dataframe_version(self):
+        return st.session_state.dataframe_version
 
 
-    def set_agent_executor(self, agent_executor):
+    def get_dataframe_fingerprint(self):
+        return st.session_state.dataframe_fingerprint
+    
+
+    def set_agent_executor(self, agent_executor, dataframe_version=None):
         st.session_state.agent_executor = agent_executor
+        st.session_state.agent_dataframe_version = dataframe_version
 
 
     def get_agent_executor(self):
         return st.session_state.agent_executor
 
 
+    def get_agent_dataframe_version(self):
+        return st.session_state.agent_dataframe_version
+
+
+    def record_token_usage(self, query, usage):
+        """Records the token usage of one answered query, and adds it to the session totals."""
+        st.session_state.query_token_usage.append({'query': query, **usage})
+        totals = st.session_state.token_usage
+        totals['queries'] += 1
+        for key in ('llm_calls', 'prompt_tokens', 'completion_tokens', 'total_tokens'):
+            totals[key] += usage.get(key, 0)
+
+
+    def get_token_usage(self):
+        return st.session_state.token_usage
+
+
+    def get_query_token_usage(self):
+        return st.session_state.query_token_usage
+
+
     def set_initial_message_sent(self, sent: bool):
         st.session_state.initial_message_sent = sent
 
@@ -0,0 +1,39 @@
+from handlers.async_handler import iterate_async
+
+
+def stream_agent_events(agent_executor, inputs: dict, config=None):
+    """
+    Runs the agent executor with astream_events and yields simplified events for the chat UI:
+    - ('tool_start', tool name) and ('tool_end', tool name) as the agent's own tools run. Tools run
+      inside them, such as the pandas agent's Python REPL, are not reported
+    - ('token', text) for each token of the agent's answer
+    - ('output', final answer) once the executor finishes
+
+    Tokens from LLM calls made inside a tool (the nested pandas agent or the RAG chain) are not
+    yielded, and text streamed before a tool call is discarded with a ('reset', None) event,
+    so that only the final answer is written into the chat message. `config` is passed to the run,
+    e.g. with callbacks that meter its token usage.
+    """
+    tool_names = {tool.name for tool in agent_executor.tools}
+    running_tools = set() # run ids of the agent's own tools, which may run concurrently
+    for event in iterate_async(agent_executor.astream_events(inputs, config=config, version='v2')):
+        kind = event['event']
+
+        if kind == 'on_tool_start' and event['name'] in tool_names:
+            running_tools.add(event['run_id'])
+            yield 'reset', None
+            yield 'tool_start', event['name']
+
+        elif kind in ('on_tool_end', 'on_tool_error') and event['run_id'] in running_tools:
+            running_tools.discard(event['run_id'])
+            yield 'tool_end', event['name']
+
+        elif kind == 'on_chat_model_stream' and not running_tools:
+            content = event['data']['chunk'].content
+            if isinstance(content, str) and content:
+                yield 'token', content
+
+        elif kind == 'on_chain_end' and not event.get('parent_ids'):
+            output = event['data'].get('output')
+            if isinstance(output, dict) and 'output' in output:
+                yield 'output', output['output']
@@ -0,0 +1,184 @@
+"""
+Token counting, per-query usage metering and the prompt budget.
+
+Every LLM call made while answering a query, by the outer agent, the nested pandas agent or the
+RAG chain, is metered by a TokenUsageMeter passed in the run's callbacks. Retrieved context and
+tool outputs are trimmed to token budgets before they are added to a prompt:
+
+    RAG_CONTEXT_MAX_TOKENS=2000    # retrieved chunks given to the knowledge_base chain
+    TOOL_OUTPUT_MAX_TOKENS=1500    # each tool's answer to the agent, and each pandas REPL output
+"""
+from langchain_core.callbacks import BaseCallbackHandler
+import functools
+import asyncio
+import logging
+import threading
+from handlers.config_handler import get_int_env
+
+
+logger = logging.getLogger(__name__)
+
+
+TOKENIZER_ENCODING = 'o200k_base' # encoding of gpt-4o-mini
+CHARS_PER_TOKEN = 4 # estimate used when the tokenizer cannot be loaded
+TRUNCATION_NOTE = '\n...[truncated to fit the prompt budget]'
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """
+    Returns the tiktoken encoding, loaded once per process. tiktoken downloads its files on first
+    use, so None is returned (and token counts are estimated) when they cannot be fetched.
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    logger.warning("Tokenizer unavailable, estimating token counts: %s", e)
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Returns the text cut down to at most max_tokens tokens, with a note that it was truncated."""
+    if max_tokens is None or max_tokens <= 0:
+        return text
+    encoding = get_encoding()
+    if encoding is None:
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        return text if len(text) <= max_chars else text[:max_chars] + TRUNCATION_NOTE
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + TRUNCATION_NOTE
+
+
+
+def get_rag_context_budget():
+    return get_int_env('RAG_CONTEXT_MAX_TOKENS', 2000)
+
+
+def get_tool_output_budget():
+    return get_int_env('TOOL_OUTPUT_MAX_TOKENS', 1500)
+
+
+def fit_docs_to_budget(docs, max_tokens):
+    """
+    Joins retrieved chunks in rank order until the budget is used up. The chunk that crosses the
+    budget is truncated, and lower ranked chunks are dropped.
+    """
+    parts = []
+    remaining = max_tokens
+    for doc in docs:
+        if remaining <= 0:
+            break
+        tokens = count_tokens(doc.page_content)
+        if tokens <= remaining:
+            parts.append(doc.page_content)
+        else:
+            parts.append(truncate_to_tokens(doc.page_content, remaining))
+        remaining -= tokens + 1 # separator
+    return "\n\n".join(parts)
+
+
+def limit_output_tokens(func):
+    """Trims what a tool's _run or _arun returns to the tool output budget."""
+
+    def limit(result):
+        if isinstance(result, str):
+            return truncate_to_tokens(result, get_tool_output_budget())
+        return result
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            return limit(await func(self, *args, **kwargs))
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return limit(func(self, *args, **kwargs))
+    return wrapper
+
+
+class TokenUsageMeter(BaseCallbackHandler):
+    """
+    Records the tokens of every LLM call in one query. The usage reported by OpenAI is used, and the
+    prompt and completion are counted with the tokenizer when a model does not report it.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._prompts = {} # run id -> prompt, only tokenized if the model reports no usage
+        self._lock = threading.Lock()
+
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        with self._lock:
+            self._prompts[run_id] = messages
+
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        with self._lock:
+            self._prompts[run_id] = prompts
+
+
+    @staticmethod
+    def get_prompt_text(prompt):
+        if prompt and isinstance(prompt[0], str):
+            return '\n'.join(prompt)
+        return '\n'.join(str(message.content) for batch in prompt or [] for message in batch)
+
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = None
+        generations = [generation for batch in response.generations for generation in batch]
+        for generation in generations:
+            usage_metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+            if usage_metadata:
+                usage = (usage_metadata.get('input_tokens', 0), usage_metadata.get('output_tokens', 0))
+        if usage is None and response.llm_output and response.llm_output.get('token_usage'):
+            token_usage = response.llm_output['token_usage']
+            usage = (token_usage.get('prompt_tokens', 0), token_usage.get('completion_tokens', 0))
+
+        with self._lock:
+            prompt = self._prompts.pop(run_id, None)
+        estimated = usage is None
+        if estimated:
+            usage = (count_tokens(self.get_prompt_text(prompt)), sum(count_tokens(generation.text) for generation in generations))
+
+        model = (response.llm_output or {}).get('model_name')
+        with self._lock:
+            self.calls.append({'model': model, 'prompt_tokens': usage[0], 'completion_tokens': usage[1], 'estimated': estimated})
+
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._prompts.pop(run_id, None)
+
+
+    def get_usage(self):
+        """Totals of the query: number of LLM calls, prompt, completion and total tokens."""
+        with self._lock:
+            prompt_tokens = sum(call['prompt_tokens'] for call in self.calls)
+            completion_tokens = sum(call['completion_tokens'] for call in self.calls)
+            return {
+                'llm_calls': len(self.calls),
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            }
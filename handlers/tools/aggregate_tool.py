@@ -0,0 +1,47 @@
+from langchain.tools import BaseTool
+from typing import Type, Optional, Literal
+from pydantic import BaseModel, Field
+from handlers.aggregate_handler import AggregateCube
+from handlers.tracing_handler import traced_tool
+from handlers.token_handler import limit_output_tokens
+
+
+class AggregateToolInput(BaseModel):
+    metric: Literal['summary', 'top', 'bottom', 'assignments'] = Field(description="'summary' for student counts, attempt rate and average/min/max percentage; 'top' or 'bottom' for the highest or lowest scoring students; 'assignments' to list the names of the uploaded assignments and form classes.")
+    group_by: Literal['assignment', 'form_class', 'assignment_and_form_class'] = Field(default='assignment', description="How to group the 'summary' metric.")
+    assignment: Optional[str] = Field(default=None, description="Optional assignment name, or part of it, to filter on.")
+    form_class: Optional[str] = Field(default=None, description="Optional form class, e.g. '2E1', to filter on.")
+    include_unattempted: bool = Field(default=False, description="Whether students who have not attempted the assignment are included in averages and rankings, counting as 0%.")
+    n: int = Field(default=5, description="Number of students per assignment for 'top' and 'bottom'.")
+
+class AggregateTool(BaseTool):
+    name: str = "aggregate_lookup"
+    description: str = "Fast lookup of precomputed statistics on the uploaded assignments: names of assignments and form classes, per-assignment or per-class student counts, attempt rates, average/min/max percentage, and top or bottom N students. Use this before 'data_analyser' whenever the question is one of these."
+    args_schema: Type[BaseModel] = AggregateToolInput
+
+    cube: Optional[AggregateCube] = None
+
+    @traced_tool
+    @limit_output_tokens
+    def _run(self, metric: str, group_by: str = 'assignment', assignment: Optional[str] = None, form_class: Optional[str] = None,
+             include_unattempted: bool = False, n: int = 5):
+        if self.cube is None:
+            return "Error: No assignments have been loaded for analysis."
+
+        try:
+            if metric == 'assignments':
+                assignments = '\n'.join(f'- {name}' for name in self.cube.assignments)
+                form_classes = '\n'.join(f'- {name}' for name in self.cube.form_classes)
+                return f"Assignments:\n{assignments}\n\nForm classes:\n{form_classes}"
+
+            if metric == 'summary':
+                result = self.cube.summary(group_by, assignment, form_class, include_unattempted)
+            else:
+                result = self.cube.rank(n, metric == 'bottom', assignment, form_class, include_unattempted)
+
+            if result is None:
+                return "No matching rows. Use metric 'assignments' to list the exact assignment and form class names."
+            return result.to_markdown(index=False, disable_numparse=True) # keep values such as '2E1' as text
+
+        except Exception as e:
+            return f"Error: {str(e)}"
@@ -2,11 +2,46 @@ import streamlit as st
 import pandas as pd
 from langchain.tools import BaseTool
 from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain_openai import ChatOpenAI
-from typing import Type
-from pydantic import BaseModel, Field
-import os
-from dotenv import load_dotenv
+from langchain_experimental.tools.python.tool import PythonAstREPLTool
+from typing import Type, Optional
+from pydantic import BaseModel, Field, PrivateAttr
+import threading
+import asyncio
+from handlers.llm_handler import get_chat_model
+from handlers.tracing_handler import traced_tool, set_span_attributes
+from handlers.token_handler import limit_output_tokens, truncate_to_tokens, get_tool_output_budget
+from handlers.answer_cache_handler import get_answer_cache
+
+
+CONTEXT_TEMPLATE = """
+            You are analyzing student assignment performance. Your input is a dataframe containing seven columns:
+            
+            KEY INFORMATION:
+            - 'Attempt Date' is a datetime indicating when the student attempted the assignment. It is NaT if the student has not attempted the assignment.
+            - 'Attempted' is True if the student has attempted the assignment and False otherwise.
+            - 'Form Class', 'Index Number', and 'Name' are the students' details.
+            - 'Percentage' contains the percentage of the total marks for the assignment that the student achieved.
+            - 'Assignment' is the name of the assignment.
+            
+            Question: {query}
+            
+            INSTRUCTIONS:
+            1. Make sure you analyse and use all the rows in the dataframes in your calculations. Do not use .head(), .sample(), or sample the data. If you only have five rows in your analysis, check and load the ORIGINAL dataframe again.
+            2. If you are asked about assignments, you should consider all the rows in the dataframes provided.
+            4. If you are asked to compare student's performance across assignments, you should locate ALL students with the same 'Form Class', 'Index Number' and 'Name' in the assignments.
+            Present the comparisons in a table format, with each row representing a student and columns for each assignment's percentage.
+            5. Use the 'Attempted' column to check whether students have attempted the assignment. Do not compare 'Attempt Date' against empty strings.
+            6. Think about the instructions again before giving your response. Ensure that you have used all the rows in the given dataframes and do not assume anything.
+            7. Format your response in a way that is easy to read and understand. Use markdown for tables and lists where appropriate. Sort the scores in descending order.
+            8. Do not use code blocks or code snippets or data types such as dictionaries or json in your response.
+            """
+
+
+class BudgetedPythonAstREPLTool(PythonAstREPLTool):
+    """The pandas agent's Python REPL, with each output trimmed to the tool output budget, e.g. when a whole dataframe is printed."""
+
+    def _run(self, query: str, run_manager=None):
+        return truncate_to_tokens(str(super()._run(query, run_manager)), get_tool_output_budget())
 
 
 class PandasAIToolInput(BaseModel):
@@ -18,29 +53,26 @@ class PandasAITool(BaseTool):
     args_schema: Type[BaseModel] = PandasAIToolInput
 
     dataframe:pd.DataFrame
-    
-    def _run(self, query: str):
-        if self.dataframe is None:
-            return "Error: No dataframes have been loaded for analysis."
-        
-        if load_dotenv():
-            llm = ChatOpenAI(
-                model='gpt-4o-mini',
-                temperature=0,
-                api_key=os.getenv('OPENAI'),
-            )
-        else:
-            llm = ChatOpenAI(
-                model='gpt-4o-mini',
-                temperature=0,
-                api_key=st.secrets['OPENAI'],
-            )
+    dataframe_version: Optional[int] = None
+    dataframe_fingerprint: Optional[str] = None # content fingerprint of the uploaded files, used to key cached answers
 
-        if not llm:
-            return "Error: LLM not initialized. Check OPENAI key."
+    # idle inner pandas agents with their REPL tools, built once per dataframe version.
+    # Each call checks one out, so concurrent calls never share a REPL.
+    _idle_agents = PrivateAttr(default_factory=list)
+    _agent_version = PrivateAttr(default=None)
+    _agent_lock = PrivateAttr(default_factory=threading.Lock)
 
-        
-        try:
+
+    def checkout_agent(self, llm):
+        """Returns an idle cached inner pandas agent and its REPL tool, building one if none is idle."""
+        with self._agent_lock:
+            if self._agent_version != self.dataframe_version:
+                self._idle_agents = []
+                self._agent_version = self.dataframe_version
+            version = self._agent_version
+            cached = self._idle_agents.pop() if self._idle_agents else None
+
+        if cached is None:
             agent = create_pandas_dataframe_agent(
                 llm=llm,
                 df=self.dataframe,
@@ -48,33 +80,87 @@ class PandasAITool(BaseTool):
                 agent_type='tool-calling',
                 allow_dangerous_code=True,
             )
+            agent.tools = [
+                BudgetedPythonAstREPLTool(locals=tool.locals, globals=tool.globals) if type(tool) is PythonAstREPLTool else tool
+                for tool in agent.tools
+            ]
+            repl_tool = next((tool for tool in agent.tools if isinstance(tool, PythonAstREPLTool)), None)
+            cached = (agent, repl_tool, version)
 
-            context = f"""
-            You are analyzing student assignment performance. Your input is a containing six columns:
-            
-            KEY INFORMATION:
-            - 'Attempt Date' indicates when the student attempted the assignment. An empty date value means the student has not attempted the assignment.
-            - 'Form Class', 'Index Number', and 'Name' are the students' details.
-            - 'Percentage' contains the percentage of the total marks for the assignment that the student achieved.
-            - 'Assignment' is the name of the assignment.
-            
-            Question: {query}
-            
-            INSTRUCTIONS:
-            1. Make sure you analyse and use all the rows in the dataframes in your calculations. Do not use .head(), .sample(), or sample the data. If you only have five rows in your analysis, check and load the ORIGINAL dataframe again.
-            2. If you are asked about assignments, you should consider all the rows in the dataframes provided.
-            4. If you are asked to compare student's performance across assignments, you should locate ALL students with the same 'Form Class', 'Index Number' and 'Name' in the assignments.
-            Present the comparisons in a table format, with each row representing a student and columns for each assignment's percentage.
-            5. Use the 'Attempt Date' column to check whether students have attempted the assignment. An empty date value indicates that the student has not attempted the assignment. Do not check for nan values. Check for empty strings.
-            6. Think about the instructions again before giving your response. Ensure that you have used all the rows in the given dataframes and do not assume anything.
-            7. Format your response in a way that is easy to read and understand. Use markdown for tables and lists where appropriate. Sort the scores in descending order.
-            8. Do not use code blocks or code snippets or data types such as dictionaries or json in your response.
-            """
-            
-            response = agent.invoke(context)
-            return response['output']
+        agent, repl_tool, _ = cached
+        if repl_tool is not None:
+            # keep the REPL globals, but do not carry variables over from previous questions. The dataframe
+            # may be shared with other sessions, so the REPL gets its own copy, which generated code can modify freely
+            repl_tool.locals = {'df': self.dataframe.copy(deep=True)}
+        return cached
+
+
+    def checkin_agent(self, cached):
+        with self._agent_lock:
+            if cached[2] == self._agent_version:
+                self._idle_agents.append(cached)
+
+
+    def prepare(self, query: str):
+        """
+        Checks that the tool can answer and looks the query up in the answer cache. Returns (llm, None)
+        when the pandas agent should run, or (None, answer) with a cached answer or an error message.
+        """
+        if self.dataframe is None:
+            return None, "Error: No dataframes have been loaded for analysis."
+
+        llm = get_chat_model()
+
+        if not llm:
+            return None, "Error: LLM not initialized. Check OPENAI key."
+
+        cached_answer = get_answer_cache().get(self.name, self.dataframe_fingerprint, query)
+        if cached_answer is not None:
+            set_span_attributes({'tool.cached': True})
+            return None, cached_answer
+
+        return llm, None
+
+
+    def store_answer(self, query: str, response):
+        get_answer_cache().set(self.name, self.dataframe_fingerprint, query, response['output'])
+        return response['output']
+
+
+    @traced_tool
+    @limit_output_tokens
+    def _run(self, query: str):
+        llm, answer = self.prepare(query)
+        if llm is None:
+            return answer
+
+        try:
+            cached = self.checkout_agent(llm)
+            try:
+                response = cached[0].invoke(CONTEXT_TEMPLATE.format(query=query))
+            finally:
+                self.checkin_agent(cached)
+            return self.store_answer(query, response)
+
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+
+    @traced_tool
+    @limit_output_tokens
+    async def _arun(self, query: str):
+        llm, answer = self.prepare(query)
+        if llm is None:
+            return answer
+
+        try:
+            # building an agent is synchronous work, so keep it off the event loop
+            cached = await asyncio.to_thread(self.checkout_agent, llm)
+            try:
+                response = await cached[0].ainvoke(CONTEXT_TEMPLATE.format(query=query))
+            finally:
+                self.checkin_agent(cached)
+            return self.store_answer(query, response)
 
-            
-            
         except Exception as e:
             return f"Error: {str(e)}"
@@ -6,15 +6,55 @@ import streamlit as st
 import pandas as pd
 from langchain.tools import BaseTool
 from langchain_chroma import Chroma
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
-from typing import Type
-from pydantic import BaseModel, Field
-import os
+from typing import Type, Optional
+from pydantic import BaseModel, Field, PrivateAttr
+from cachetools import LRUCache
+import threading
+import asyncio
 import chromadb
-from dotenv import load_dotenv
+from handlers.llm_handler import get_chat_model
+from handlers.rag_handler import get_shared_vectorstore
+from handlers.tracing_handler import traced_tool, set_span_attributes
+from handlers.token_handler import fit_docs_to_budget, get_rag_context_budget, limit_output_tokens
+from handlers.answer_cache_handler import get_answer_cache, normalize_query
+
+RETRIEVAL_K = 4
+
+TEMPLATE = """You are an assistant for question-answering tasks related to the EdTech Masterplan 2030 and Key Applications of Technology in the classroom.
+                Use the following pieces of retrieved context to answer the question.
+                If you don't know the answer, just say you don't know.
+                Keep the answer concise and relevant to the retrieved information.\n\n
+                
+                Context: {context}
+
+                Question: {question}
+
+                Answer:
+            """
+
+# Shared by all sessions: normalized query -> (query embedding, ids of the top-k retrieved chunks).
+# The knowledge base is static, so this only needs clearing when the vector_db collection changes.
+_retrieval_cache = LRUCache(maxsize=512)
+_retrieval_cache_collection = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_collection_fingerprint(vectorstore: Chroma):
+    """
+    Identifies the current contents of the collection by its id, name and number of chunks. A rebuild
+    deletes and re-creates the collection, so its id changes even when the number of chunks does not.
+    """
+    collection = vectorstore._collection # langchain_chroma has no public accessor for the collection
+    return f'{collection.id}:{collection.name}:{collection.count()}'
+
+
+def format_docs(docs):
+    """Joins the retrieved chunks in rank order, trimmed to the RAG context token budget."""
+    return fit_docs_to_budget(docs, get_rag_context_budget())
+
 
 class RAGToolInput(BaseModel):
     query: str = Field(description="The natural language question to ask about how to apply technology in the classroom that is aligned with the EdTech Masterplan 2030 and the Key Applications of Technology framework.")
@@ -24,60 +64,140 @@ class RAGTool(BaseTool):
     description: str = "Useful for answering questions about the EdTech Masterplan 2030 and Key Applications of Technology in the classroom."
     args_schema: Type[BaseModel] = RAGToolInput
 
-    vectorstore: Chroma
-    
-    def _run(self, query: str):
+    vectorstore: Optional[Chroma] = None # None means the process-wide vectorstore, loaded on first use
 
-        if not self.vectorstore:
-            return "Error: No vectorstore available."
-        
-        if load_dotenv():
-            llm = ChatOpenAI(
-                model='gpt-4o-mini',
-                temperature=0,
-                api_key=os.getenv('OPENAI'),
-            )
-        else:
-            llm = ChatOpenAI(
-                model='gpt-4o-mini',
-                temperature=0,
-                api_key=st.secrets['OPENAI'],
-            )
+    _chain = PrivateAttr(default=None)
+    _collection_fingerprint = PrivateAttr(default=None)
 
-        if not llm:
-            return "Error: LLM not initialized. Check OPENAI key."
-        
-        try:
-            
-            template = """You are an assistant for question-answering tasks related to the EdTech Masterplan 2030 and Key Applications of Technology in the classroom.
-                Use the following pieces of retrieved context to answer the question.
-                If you don't know the answer, just say you don't know.
-                Keep the answer concise and relevant to the retrieved information.\n\n
-                
-                Context: {context}
 
-                Question: {question}
+    def get_vectorstore(self):
+        if self.vectorstore is None:
+            return get_shared_vectorstore()
+        return self.vectorstore
+
+
+    def get_cached_retrieval(self, key):
+        """Returns the cached (embedding, chunk ids) of a normalized query, clearing the cache if the collection changed."""
+        global _retrieval_cache_collection
+        with _retrieval_cache_lock:
+            if _retrieval_cache_collection != self._collection_fingerprint:
+                _retrieval_cache.clear()
+                _retrieval_cache_collection = self._collection_fingerprint
+            return _retrieval_cache.get(key)
 
-                Answer:
-            """
 
-            prompt_template = PromptTemplate.from_template(template)
-            
-            retriever = self.vectorstore.as_retriever()
+    def get_docs_by_ids(self, vectorstore, ids):
+        """Reads cached chunks back in rank order, or returns None if any of them no longer exists."""
+        docs_by_id = {doc.id: doc for doc in vectorstore.get_by_ids(ids)}
+        if len(docs_by_id) == len(ids):
+            return [docs_by_id[doc_id] for doc_id in ids]
+        return None
 
-            def format_docs(docs):
-                return "\n\n".join(doc.page_content for doc in docs)
 
-            rag_chain = (
-                {"context": retriever | format_docs, "question": RunnablePassthrough()}
-                | prompt_template
+    def search(self, vectorstore, key, embedding):
+        docs = vectorstore.similarity_search_by_vector(embedding, k=RETRIEVAL_K)
+        with _retrieval_cache_lock:
+            _retrieval_cache[key] = (embedding, [doc.id for doc in docs])
+        return docs
+
+
+    def retrieve(self, query: str):
+        """Returns the top-k chunks for the query, reusing the cached embedding and chunk ids for repeated questions."""
+        key = normalize_query(query)
+        cached = self.get_cached_retrieval(key)
+        vectorstore = self.get_vectorstore()
+        if cached is not None:
+            docs = self.get_docs_by_ids(vectorstore, cached[1])
+            if docs is not None:
+                return docs
+
+        embedding = cached[0] if cached is not None else vectorstore.embeddings.embed_query(query)
+        return self.search(vectorstore, key, embedding)
+
+
+    async def aretrieve(self, query: str):
+        """Async version of retrieve. The query is embedded asynchronously, and the local Chroma reads run in a thread."""
+        key = normalize_query(query)
+        cached = self.get_cached_retrieval(key)
+        vectorstore = self.get_vectorstore()
+        if cached is not None:
+            docs = await asyncio.to_thread(self.get_docs_by_ids, vectorstore, cached[1])
+            if docs is not None:
+                return docs
+
+        embedding = cached[0] if cached is not None else await vectorstore.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self.search, vectorstore, key, embedding)
+
+
+    def get_chain(self, llm):
+        """Returns the long-lived RAG chain of this tool, built on first use."""
+        if self._chain is None:
+            self._chain = (
+                {"context": RunnableLambda(self.retrieve, afunc=self.aretrieve) | format_docs, "question": RunnablePassthrough()}
+                | PromptTemplate.from_template(TEMPLATE)
                 | llm
                 | StrOutputParser()
             )
+        return self._chain
+
+
+    def prepare(self, query: str):
+        """
+        Checks that the tool can answer and looks the query up in the answer cache. Returns (llm, None)
+        when the RAG chain should run, or (None, answer) with a cached answer or an error message.
+        Reads the local Chroma collection, so async callers run it in a thread.
+        """
+        try:
+            vectorstore = self.get_vectorstore()
+        except Exception as e:
+            return None, f"Error: No vectorstore available. {str(e)}"
+
+        llm = get_chat_model()
+
+        if not llm:
+            return None, "Error: LLM not initialized. Check OPENAI key."
+
+        try:
+            self._collection_fingerprint = get_collection_fingerprint(vectorstore)
+            cached_answer = get_answer_cache().get(self.name, self._collection_fingerprint, query)
+        except Exception as e:
+            return None, f"Error: {str(e)}"
+
+        if cached_answer is not None:
+            set_span_attributes({'tool.cached': True})
+            return None, cached_answer
+
+        return llm, None
+
+
+    def store_answer(self, query: str, response):
+        get_answer_cache().set(self.name, self._collection_fingerprint, query, response)
+        return response
+
+
+    @traced_tool
+    @limit_output_tokens
+    def _run(self, query: str):
+        llm, answer = self.prepare(query)
+        if llm is None:
+            return answer
+
+        try:
+            return self.store_answer(query, self.get_chain(llm).invoke(query))
+
+        except Exception as e:
+            return f"Error: {str(e)}"
 
-            response = rag_chain.invoke(query)
 
-            return response
+    @traced_tool
+    @limit_output_tokens
+    async def _arun(self, query: str):
+        llm, answer = await asyncio.to_thread(self.prepare, query)
+        if llm is None:
+            return answer
+
+        try:
+            return self.store_answer(query, await self.get_chain(llm).ainvoke(query))
 
         except Exception as e:
             return f"Error: {str(e)}"
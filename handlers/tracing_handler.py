@@ -0,0 +1,172 @@
+"""
+OpenTelemetry tracing of the upload, agent and LLM pipeline, and an opt-in profiler of Streamlit reruns.
+
+Tracing is off unless an exporter is configured, in which case spans are recorded for each rerun,
+zip validation and parsing, agent builds, tool calls and every OpenAI chat and embedding request:
+
+    TRACING_EXPORTER=console   # print finished spans to stdout
+    TRACING_EXPORTER=otlp      # send spans to OTEL_EXPORTER_OTLP_ENDPOINT (default localhost:4317)
+
+    PROFILE_RERUNS=1           # cProfile each rerun, printing the slowest calls and saving to PROFILE_DIR
+
+The OpenTelemetry SDK is only imported when tracing is enabled, so the disabled path costs no startup time.
+"""
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import asyncio
+import functools
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+SERVICE_NAME = 'learning-insights'
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is disabled."""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_tracer = None
+_tracing_lock = threading.Lock()
+_tracing_configured = False
+
+
+def setup_tracing():
+    """Installs the tracer provider configured by TRACING_EXPORTER, once per process. Returns True if tracing is enabled."""
+    global _tracer, _tracing_configured
+    with _tracing_lock:
+        if _tracing_configured:
+            return _tracer is not None
+        _tracing_configured = True
+
+        exporter_name = os.getenv('TRACING_EXPORTER', '').lower()
+        if not exporter_name:
+            return False
+
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+        if exporter_name == 'console':
+            exporter = ConsoleSpanExporter()
+        elif exporter_name == 'otlp':
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter()
+        else:
+            logger.warning("Unknown TRACING_EXPORTER '%s', tracing disabled. Use 'console' or 'otlp'.", exporter_name)
+            return False
+
+        provider = TracerProvider(resource=Resource.create({'service.name': SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _tracer = trace.get_tracer(SERVICE_NAME)
+        return True
+
+
+def is_tracing_enabled():
+    return _tracer is not None
+
+
+def start_span(name, attributes=None, record_exception=True):
+    """
+    Context manager starting a span as a child of the current one. Attributes with None values are
+    dropped. Set record_exception=False for spans that end with control flow exceptions, e.g. st.rerun().
+    """
+    if _tracer is None:
+        return nullcontext(_NOOP_SPAN)
+    attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+    return _tracer.start_as_current_span(name, attributes=attributes, record_exception=record_exception,
+                                         set_status_on_exception=record_exception)
+
+
+def start_manual_span(name, attributes=None):
+    """Starts a span that the caller must end(), for work that outlives the current call, e.g. a streamed response."""
+    if _tracer is None:
+        return _NOOP_SPAN
+    attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+    return _tracer.start_span(name, attributes=attributes)
+
+
+def end_span(span, attributes=None):
+    if span is _NOOP_SPAN:
+        return
+    span.set_attributes({key: value for key, value in (attributes or {}).items() if value is not None})
+    span.end()
+
+
+def set_span_attributes(attributes):
+    """Adds attributes to the current span, e.g. a row count only known at the end of the work."""
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    trace.get_current_span().set_attributes({key: value for key, value in attributes.items() if value is not None})
+
+
+def traced_tool(func):
+    """Wraps a tool's _run or _arun in a 'tool.<name>' span recording the input and output sizes."""
+
+    def get_attributes(tool, args, kwargs):
+        tool_input = ' '.join(str(value) for value in list(args) + list(kwargs.values()))
+        return {'tool.name': tool.name, 'tool.input_chars': len(tool_input)}
+
+    def set_output_attributes(span, result):
+        output = str(result)
+        span.set_attributes({'tool.output_chars': len(output), 'tool.error': output.startswith('Error:')})
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            with start_span(f'tool.{self.name}', get_attributes(self, args, kwargs)) as span:
+                result = await func(self, *args, **kwargs)
+                set_output_attributes(span, result)
+                return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with start_span(f'tool.{self.name}', get_attributes(self, args, kwargs)) as span:
+            result = func(self, *args, **kwargs)
+            set_output_attributes(span, result)
+            return result
+    return wrapper
+
+
+@contextmanager
+def profile_rerun(top=15):
+    """
+    Profiles one Streamlit rerun with cProfile when PROFILE_RERUNS=1. The slowest calls by cumulative
+    time are printed, and the full profile is saved to PROFILE_DIR for snakeviz or pstats.
+    """
+    if os.getenv('PROFILE_RERUNS') != '1':
+        yield
+        return
+
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_dir = os.getenv('PROFILE_DIR', os.path.join('.cache', 'profiles'))
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f"rerun-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.prof")
+        profiler.dump_stats(path)
+        stats = io.StringIO()
+        pstats.Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(top)
+        logger.info('Rerun profile saved to %s\n%s', path, stats.getvalue())
@@ -1,17 +1,19 @@
-__import__('pysqlite3')
-import sys
-sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
-
+# Only Streamlit, pandas and light handlers are imported here, so that the login page and file uploader
+# render quickly. LangChain, Chroma and the pysqlite3 swap are imported on the first agent build or RAG call.
 import streamlit as st
 import os
+import logging
 from handlers.login_handler import check_password
 from handlers.state_manager import AppState
-from handlers.file_handler import process_zip_files, is_valid_zip_file
-from handlers.rag_handler import load_vectorstore_from_directory
-from handlers.agent_builder import create_agent_executor
+from handlers.file_handler import ingest_zip_files, append_to_dataframe, is_valid_zip_name, get_upload_bytes, get_content_hash, get_dataset_fingerprint, load_parsed_frames
+from handlers.aggregate_handler import build_aggregate_cube
+from handlers.answer_cache_handler import get_answer_cache
+from handlers.async_handler import run_coroutine
+from handlers.tracing_handler import setup_tracing, start_span, profile_rerun
 import pandas as pd
-from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
+
+
+logger = logging.getLogger(__name__)
 
 def main():
     
@@ -37,19 +39,6 @@ def main():
     # initialise variables and agent
     app_state = AppState()
 
-    if load_dotenv():
-        llm = ChatOpenAI(
-            model='gpt-4o-mini',
-            temperature=0,
-            api_key=os.getenv('OPENAI'),
-        )
-    else:
-        llm = ChatOpenAI(
-            model='gpt-4o-mini',
-            temperature=0,
-            api_key=st.secrets['OPENAI'],
-        )
-
     greeting = """Hello! I am your friendly Intelligent Insight Agent, here to help you analyse your students' performance on assignments in \
         the Singapore Student Learning Space (SLS).\n\nTo begin, upload assignment Marks .zip files that you have downloaded from SLS in the file uploader on the left. You can upload more than one zip file \
         across multiple classes and assignments. Each zip file should contain exactly one CSV file with the assignment marks.\n\nYou can also ask me about how to apply the EdTech Masterplan or the Key Applications \
@@ -60,14 +49,16 @@ def main():
     """
 
     current_dataframe = app_state.get_dataframe()
-    current_vectorstore = app_state.get_vectorstore()
     current_agent = app_state.get_agent_executor() 
 
-    if current_vectorstore is None:
-        app_state.set_vectorstore(load_vectorstore_from_directory())
-        current_vectorstore = app_state.get_vectorstore()
+    # the vectorstore is shared by all sessions and loaded when the knowledge base is first queried;
+    # set VECTORSTORE_WARMUP=1 to load it in the background as soon as the server starts serving
+    if os.getenv('VECTORSTORE_WARMUP') == '1':
+        from handlers.rag_handler import start_vectorstore_warmup
+        start_vectorstore_warmup()
 
     new_df_required = False
+    current_version = app_state.get_dataframe_version()
     if current_dataframe is not None:
         # dataframe has been loaded
         if current_agent is None:
@@ -75,16 +66,17 @@ def main():
             new_df_required = True
         else:
             # agent available
-            if current_agent.tools[0].dataframe.equals(current_dataframe) == False:
-                # the dataframes are not the same
+            if app_state.get_agent_dataframe_version() != current_version:
+                # the agent was built against an older version of the dataframe
                 new_df_required = True
 
     # new agent required, i.e., this is the first time or dataframe has changed
     if new_df_required:
-        if llm:
-            new_agent = create_agent_executor(current_dataframe, current_vectorstore)
-            if new_agent:
-                app_state.set_agent_executor(new_agent)
+        from handlers.agent_builder import create_agent_executor
+        new_agent = create_agent_executor(current_dataframe, None, current_version, app_state.get_aggregate_cube(),
+                                          app_state.get_dataframe_fingerprint())
+        if new_agent:
+            app_state.set_agent_executor(new_agent, current_version)
               
     # initialise first message
     if not app_state.get_initial_message_sent():
@@ -98,9 +90,16 @@ def main():
 
     # print messages in chat_history. at first run, this prints the greeting
     with message_con:
-        for message in app_state.get_chat_history():
+        # earlier messages are read from the chat store only when asked for
+        if app_state.has_earlier_messages():
+            if st.button('Show earlier messages', key='load_earlier_messages'):
+                app_state.load_earlier_messages()
+                st.rerun()
+        for message in app_state.get_earlier_messages() + app_state.get_chat_history():
             with st.chat_message(message['role']):
                 st.markdown(message['content'])
+                if message.get('cached'):
+                    st.caption('⚡ Cached answer')
     
     with chat_con:
         user_message = st.chat_input('Ask me anything about the assignments you have uploaded!')
@@ -109,6 +108,11 @@ def main():
         with st.form('file_upload_form', clear_on_submit=True, border=False):
             file_uploads = st.file_uploader('File Uploader', accept_multiple_files=True, type='zip', key='zips')
             upload_button = st.form_submit_button('Upload files')
+
+        storage_usage = app_state.get_storage_usage()
+        if storage_usage['files']:
+            limit = f" of {storage_usage['max_bytes'] / 1024 / 1024:.0f} MB" if storage_usage['max_bytes'] else ''
+            st.caption(f"Session data: {storage_usage['total_bytes'] / 1024 / 1024:.1f} MB{limit} ({storage_usage['files']} files)")
         
         st.markdown("""
 IMPORTANT NOTICE: This web application is developed as a proof-of-concept prototype. The information provided here is NOT intended for actual usage and should not be relied upon for making any decisions, especially those related to financial, legal, or healthcare matters.
@@ -131,66 +135,209 @@ Always consult with qualified professionals for accurate and personalized advice
         st.rerun()
 
     chat_history = app_state.get_chat_history()
-    if chat_history and len(st.session_state.chat_history) > 0:
-        last_message = st.session_state.chat_history[-1]
+    if chat_history:
+        last_message = chat_history[-1]
         if last_message['role'] == 'user':
             user_message = last_message['content']
             
-            with status_con:
-                with st.spinner('Thinking...'):
-                    handle_chat_input(app_state, user_message)
-                    st.rerun()
+            if os.getenv('CHAT_STREAMING', '1') == '1':
+                # tokens and tool progress are written into the chat message as they arrive
+                handle_chat_input(app_state, user_message, message_con)
+                st.rerun()
+            else:
+                with status_con:
+                    with st.spinner('Thinking...'):
+                        handle_chat_input(app_state, user_message)
+                        st.rerun()
 
 
 def handle_zip_uploads(app_state: AppState, uploaded_files):
-    '''Processes newly uploaded .zip files for dataframe'''
+    '''Processes newly uploaded .zip files for dataframe. Only files that have not been parsed before are processed.'''
     valid_zips = []
     invalid_zips = []
+    repeated_zips = []
+    candidate_files_info = []
     nl = '''  
     '''
     for uploaded_file in uploaded_files:
-        is_valid = is_valid_zip_file(uploaded_file)
-        if is_valid:
-            app_state.add_uploaded_file_info(uploaded_file.name, uploaded_file.getvalue())
-            valid_zips.append(uploaded_file.name)
-        else:
-            invalid_zips.append(uploaded_file.name)
+        if not is_valid_zip_name(uploaded_file.name):
+            invalid_zips.append(f'{uploaded_file.name}: the file name does not end with a YYYYMMDD date')
+            continue
+        file_content = get_upload_bytes(uploaded_file) # the uploaded bytes themselves, not a copy
+        file_hash = get_content_hash(file_content)
+        if app_state.has_parsed_file(file_hash) or file_hash in [f['hash'] for f in candidate_files_info]:
+            repeated_zips.append(uploaded_file.name)
+            continue
+        candidate_files_info.append({'name': uploaded_file.name, 'content': file_content, 'hash': file_hash})
+
+    new_frames = []
+    if candidate_files_info:
+        with st.spinner('Processing files...'), start_span('handle_zip_uploads', {'files.count': len(candidate_files_info)}):
+            # each archive is opened once, to check its contents and to stream-parse its CSV
+            frames, errors = ingest_zip_files(candidate_files_info)
+        for file_info, df, error in zip(candidate_files_info, frames, errors):
+            if df is None:
+                invalid_zips.append(f"{file_info['name']}: {error}")
+                continue
+            # only the parsed rows are kept; the raw .zip bytes are released with the upload
+            app_state.add_parsed_file(file_info['name'], file_info['hash'], df)
+            valid_zips.append(file_info['name'])
+            new_frames.append(df)
 
     if valid_zips:
         file_list = [f'{i+1}. {filename}' for i, filename in enumerate(valid_zips)]
         app_state.add_message('assistant', f"""I've received the following valid Marks .zip files:  
                                 {nl.join(file_list)}  """)
 
-    all_uploaded_data_files = [f['name'] for f in app_state.get_uploaded_files_info()]
-    if all_uploaded_data_files:
-        with st.spinner('Processing files...'):
-            dataframe = process_zip_files(app_state.get_uploaded_files_info())
-            if dataframe is not None:
-                app_state.set_dataframe(dataframe)
-                app_state.add_message('assistant', 'The Marks .zip files have been successfully processed! You can now ask me questions about them.')
-            else:
-                app_state.add_message('assistant', "I'm sorry, I could not process the .zip files properly. Please check the contents of the .zip files.")
-    else:
+    if repeated_zips:
+        file_list = [f'{i+1}. {filename}' for i, filename in enumerate(repeated_zips)]
+        app_state.add_message('assistant', f"""The following Marks .zip files have already been uploaded and were skipped:  
+                                {nl.join(file_list)}  """)
+
+    if invalid_zips:
+        file_list = [f'{i+1}. {filename}' for i, filename in enumerate(invalid_zips)]
+        app_state.add_message('assistant', f"""The following files are not valid Marks .zip files and were skipped:  
+                                {nl.join(file_list)}  """)
+
+    if new_frames:
+        fingerprint = get_dataset_fingerprint(app_state.get_parsed_file_hashes())
+        if not app_state.use_shared_dataset(fingerprint):
+            dataframe = app_state.get_dataframe()
+            shared = dataframe is None or app_state.get_dataframe_fingerprint() is not None
+            if not shared:
+                # a dataframe kept private after an eviction is only shared once rebuilt from the parsed frames of all the files
+                all_frames = load_parsed_frames(app_state.get_parsed_file_hashes())
+                if all_frames is not None:
+                    dataframe, new_frames, shared = None, all_frames, True
+            dataframe = append_to_dataframe(dataframe, new_frames)
+            app_state.set_dataframe(dataframe, fingerprint if shared else None, build_aggregate_cube(dataframe))
+        app_state.add_message('assistant', 'The Marks .zip files have been successfully processed! You can now ask me questions about them.')
+
+        def get_eviction_notice(evicted_files):
+            file_list = [f'{i+1}. {filename}' for i, filename in enumerate(evicted_files)]
+            return f"""To stay within this session's memory limit, the data of these earlier uploads was removed:  
+                                {nl.join(file_list)}  """
+
+        # the notice is added by enforce_storage_budget, as it counts against the budget too
+        app_state.enforce_storage_budget(get_eviction_notice)
+    elif candidate_files_info:
+        app_state.add_message('assistant', "I'm sorry, I could not process the .zip files properly. Please check the contents of the .zip files.")
+    elif not repeated_zips:
         app_state.add_message('assistant', 'No valid Marks .zip files were uploaded. Please try again with a valid .zip file.')
 
 
-def handle_chat_input(app_state: AppState, user_query: str):
-    
+def handle_chat_input(app_state: AppState, user_query: str, message_con=None):
+    '''Answers the user's query. If a message container is given, the answer is streamed into it.'''
     agent_executor = app_state.get_agent_executor()
 
     if not agent_executor:
         app_state.add_message('assistant', 'I do not have any information loaded. Please upload Marks .zip file(s) first.')
         return
     
+    from handlers.token_handler import TokenUsageMeter
+    from handlers.memory_handler import ToolFactRecorder
+
+    # the same question on the same uploaded files, in this or another session, is answered from the cache.
+    # follow-up questions may depend on earlier turns, so only the opening question of a conversation is cached
+    memory = app_state.get_conversation_memory()
+    standalone_query = memory.is_empty()
+    fingerprint = app_state.get_dataframe_fingerprint()
+    cached_answer = get_answer_cache().get('agent', fingerprint, user_query) if standalone_query else None
+    if cached_answer is not None:
+        app_state.add_message('assistant', cached_answer, cached=True)
+        memory.add_turn(user_query, cached_answer)
+        return
+
+    # meters every LLM call made for this query, including those of the pandas agent and the RAG chain
+    meter = TokenUsageMeter()
+    facts = ToolFactRecorder()
+    config = {'callbacks': [meter, facts]}
+    inputs = {'input': user_query, 'chat_history': memory.get_messages()}
+
     try:
-        response = agent_executor.invoke({'input': user_query})
-        final_answer = response.get('output', 'I could not find an answer to your question.')
+        with start_span('agent_executor.run', {'chat.query_chars': len(user_query), 'chat.streaming': message_con is not None,
+                                               'chat.memory_tokens': memory.count_tokens()}):
+            if message_con is not None:
+                final_answer = stream_chat_response(agent_executor, inputs, message_con, config)
+            else:
+                # the async path runs independent tool calls from the same agent step concurrently
+                response = run_coroutine(agent_executor.ainvoke(inputs, config=config))
+                final_answer = response.get('output')
+
+        if final_answer is not None:
+            if standalone_query:
+                get_answer_cache().set('agent', fingerprint, user_query, final_answer)
+        else:
+            final_answer = 'I could not find an answer to your question.'
         app_state.add_message('assistant', final_answer)
+
+        # older turns are summarised once they leave the memory's recent window, metered with the query
+        memory.add_facts(facts.get_facts())
+        memory.add_turn(user_query, final_answer, config={'callbacks': [meter]})
     
     except Exception as e:
         error_msg = f'I apologize, but I encountered an error while processing your question: {str(e)}'
         app_state.add_message('assistant', error_msg)
 
+    finally:
+        record_token_usage(app_state, user_query, meter.get_usage())
+
+
+def record_token_usage(app_state: AppState, user_query: str, usage: dict):
+    '''Adds the token usage of a query to the session totals and logs both.'''
+    app_state.record_token_usage(user_query, usage)
+    session_usage = app_state.get_token_usage()
+    logger.info("Token usage: %d LLM calls, %d prompt + %d completion tokens (session: %d tokens over %d queries)",
+                usage['llm_calls'], usage['prompt_tokens'], usage['completion_tokens'], session_usage['total_tokens'], session_usage['queries'])
+
+
+TOOL_LABELS = {
+    'data_analyser': 'Analysing the uploaded marks',
+    'aggregate_lookup': 'Looking up assignment statistics',
+    'knowledge_base': 'Searching the EdTech Masterplan and Key Applications of Technology',
+}
+
+
+def stream_chat_response(agent_executor, inputs: dict, message_con, config=None):
+    '''Streams the agent's answer into a new assistant chat message, showing which tool is running. Returns the final answer.'''
+    from handlers.stream_handler import stream_agent_events
+
+    with message_con:
+        with st.chat_message('assistant'):
+            step_placeholder = st.empty()
+            answer_placeholder = st.empty()
+            step_placeholder.caption('Thinking...')
+
+            tokens = []
+            final_answer = None
+            running_tools = [] # names of the running tools, latest last; the same tool may run more than once
+            for kind, value in stream_agent_events(agent_executor, inputs, config):
+                if kind == 'tool_start':
+                    running_tools.append(value)
+                elif kind == 'tool_end' and value in running_tools:
+                    running_tools.remove(value)
+                if kind in ('tool_start', 'tool_end'):
+                    step_placeholder.caption(f'{TOOL_LABELS.get(running_tools[-1], running_tools[-1])}...' if running_tools else 'Thinking...')
+                elif kind == 'reset':
+                    tokens = []
+                    answer_placeholder.empty()
+                elif kind == 'token':
+                    tokens.append(value)
+                    answer_placeholder.markdown(''.join(tokens) + '▌')
+                elif kind == 'output':
+                    final_answer = value
+
+            step_placeholder.empty()
+
+    if final_answer is None and tokens:
+        final_answer = ''.join(tokens)
+    return final_answer
+
 
 if __name__ == '__main__':
-    main()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    setup_tracing()
+    # Streamlit runs this script once per rerun, so each rerun is one trace (and one profile with PROFILE_RERUNS=1).
+    # st.rerun() and st.stop() end the script with exceptions, which are not errors.
+    with profile_rerun(), start_span('streamlit.rerun', record_exception=False):
+        main()
@@ -0,0 +1,89 @@
+"""
+Import-time report for the app's startup path, used as a regression check for cold starts.
+
+Runs `python -X importtime -c "import main"` from the repository root, prints the slowest top-level
+imports, and exits with a non-zero status if a heavy module (LangChain, Chroma, OpenAI, tiktoken,
+pysqlite3) is imported before the login page can render, or if the total exceeds --max-ms.
+
+Usage:
+    python scripts/import_time_report.py [--top 15] [--max-ms 2000]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must only be imported on the first agent build or RAG call
+DEFERRED_MODULES = (
+    'langchain',
+    'langchain_core',
+    'langchain_openai',
+    'langchain_experimental',
+    'langchain_chroma',
+    'langchain_community',
+    'chromadb',
+    'openai',
+    'tiktoken',
+    'pysqlite3',
+)
+
+
+def measure_imports(module='main'):
+    """Returns a list of (depth, module name, self microseconds, cumulative microseconds) for each import."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr}')
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='main', help='module to import, relative to the repository root')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest packages to print')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if the total import time exceeds this')
+    args = parser.parse_args()
+
+    imports = measure_imports(args.module)
+    total_ms = sum(cumulative for depth, _, _, cumulative in imports if depth == 0) / 1000
+
+    # attribute each module's own import time to its top-level package
+    packages = {}
+    for _, name, self_us, _ in imports:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    print(f'Total import time of {args.module} (including interpreter startup imports): {total_ms:.0f} ms')
+    for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f'{self_us / 1000:10.1f} ms  {package}')
+
+    failed = False
+    deferred = sorted({name for _, name, _, _ in imports if name.split('.')[0] in DEFERRED_MODULES})
+    if deferred:
+        print(f'\nFAIL: modules that should be imported lazily were imported at startup: {", ".join(deferred[:10])}')
+        failed = True
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f'\nFAIL: total import time {total_ms:.0f} ms exceeds the budget of {args.max_ms:.0f} ms')
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()